@@ -0,0 +1,79 @@
+import numpy as np
+
+from ResultsBuffer import ResultsBuffer
+
+#Agent state codes
+SUSCEPTIBLE = 0
+INFECTED = 1
+RECOVERED = 2
+DEAD = 3
+
+
+class AgentStateRecorder:
+    """Per-agent state history, stored as the initial states plus a log of (step, agent, old, new) transitions."""
+
+    def __init__(self, initial_states, sink=None, flush_every=None):
+        self.initial = np.asarray(initial_states, dtype=np.uint8).copy()
+        self.current = self.initial.copy()
+        #The last step whose transitions are all in the log
+        self.steps = 0
+        self.log = ResultsBuffer({"Step": np.int64, "Agent": np.int64, "Old": np.uint8, "New": np.uint8}, capacity=max(len(self.initial), 1), sink=sink, flush_every=flush_every)
+
+    def record(self, step, agent, new):
+        #One agent changed state during `step`
+        old = self.current[agent]
+        if old != new:
+            self.log.append({"Step": step, "Agent": agent, "Old": old, "New": new})
+            self.current[agent] = new
+
+    def capture(self, step, states):
+        #The state of every agent after `step`; only the agents that changed are logged
+        states = np.asarray(states, dtype=np.uint8)
+        changed = np.flatnonzero(states != self.current)
+        self.log.extend({
+            "Step": np.full(len(changed), step, dtype=np.int64),
+            "Agent": changed,
+            "Old": self.current[changed],
+            "New": states[changed],
+        })
+        self.current[changed] = states[changed]
+        self.steps = step
+
+    def finish_step(self, step):
+        #Called after the transitions of `step` have been passed to record()
+        self.steps = step
+
+    def transitions(self):
+        #The log as NumPy columns, in the order the transitions happened
+        return {name: self.log.column(name) for name in self.log.data}
+
+    def to_frame(self):
+        return self.log.to_frame()
+
+    def _apply(self, states, agents, new):
+        #Applies the log entries with these Agent and New values, in order; when an agent changed more than once the last change wins
+        agents, last = np.unique(agents[::-1], return_index=True)
+        states[agents] = new[::-1][last]
+
+    def states_at(self, step):
+        #The state of every agent after `step` (0 is the initial state)
+        #Each column is read once, since with a sink that reads the flushed rows back
+        end = np.searchsorted(self.log.column("Step"), step, side='right')
+        states = self.initial.copy()
+        self._apply(states, self.log.column("Agent")[:end], self.log.column("New")[:end])
+        return states
+
+    def history(self, num_steps=None):
+        #Dense (steps + 1) x agents uint8 matrix; row s holds the states after step s
+        num_steps = self.steps if num_steps is None else num_steps
+        steps, agents, new = self.log.column("Step"), self.log.column("Agent"), self.log.column("New")
+        history = np.empty((num_steps + 1, len(self.initial)), dtype=np.uint8)
+        history[0] = self.initial
+        bounds = np.searchsorted(steps, np.arange(num_steps + 1), side='right')
+        for s in range(1, num_steps + 1):
+            history[s] = history[s - 1]
+            self._apply(history[s], agents[bounds[s - 1]:bounds[s]], new[bounds[s - 1]:bounds[s]])
+        return history
+
+    def save(self, path):
+        np.savez_compressed(path, initial=self.initial, **self.transitions())
@@ -0,0 +1,86 @@
+import json
+import os
+
+import numpy as np
+
+from AgentStateRecorder import AgentStateRecorder
+from RollingResults import RollingResults
+
+#A checkpoint is a single .npz file: NumPy arrays for the graph, the per-agent state, the results and the agent-state log, plus a "meta" entry holding JSON with the model's parameters, its scalar state and the states of its random number generators.
+#NetworkModel and MoneyModel write them with save_checkpoint(path) and read them back with from_checkpoint(path, **overrides).
+
+
+def save_checkpoint(path, meta, arrays):
+    #`path` can also be a binary file object, e.g. an io.BytesIO to fork a model in memory
+    if hasattr(path, "write"):
+        np.savez_compressed(path, meta=np.array(json.dumps(meta, default=lambda value: value.item())), **arrays)
+        return
+    #Written to a temporary file and renamed into place, so a job preempted while saving still has its previous checkpoint
+    path = os.fspath(path)
+    tmp = os.path.join(os.path.dirname(path), "." + os.path.basename(path) + ".tmp")
+    with open(tmp, "wb") as f:
+        save_checkpoint(f, meta, arrays)
+    os.replace(tmp, path)
+
+def load_checkpoint(path):
+    with np.load(path, allow_pickle=False) as data:
+        arrays = {name: data[name] for name in data.files}
+    return json.loads(str(arrays.pop("meta"))), arrays
+
+def random_state(generator):
+    #The state of a random.Random as plain JSON values
+    version, internal, gauss_next = generator.getstate()
+    return [version, list(internal), gauss_next]
+
+def set_random_state(generator, state):
+    version, internal, gauss_next = state
+    generator.setstate((version, tuple(internal), gauss_next))
+
+def buffer_arrays(prefix, buffer):
+    #Every row of a ResultsBuffer, flushed ones included, as "<prefix>/<column>" arrays, and how many of them were flushed. For a RollingResults, the rows it kept, with their steps and its own state.
+    arrays = {f"{prefix}/{name}": buffer.column(name) for name in buffer.data}
+    if isinstance(buffer, RollingResults):
+        arrays[f"{prefix}.steps"] = buffer.steps()
+        arrays[f"{prefix}.retention"] = np.array(json.dumps(buffer.state()))
+    else:
+        arrays[f"{prefix}.flushed"] = np.array(buffer.flushed)
+    return arrays
+
+def restore_buffer(buffer, prefix, arrays):
+    #Appends the rows saved by buffer_arrays.
+    #With a sink that the run was flushed to, the rows flushed by the checkpoint are already there: the sink drops any it got after the checkpoint, and only the rest are appended, to be written out at the next flush.
+    #With an empty sink, e.g. a new directory, every row is appended and written out again.
+    columns = {name: arrays[f"{prefix}/{name}"] for name in buffer.data}
+    if f"{prefix}.retention" in arrays:
+        #Only some of the rows were kept, so they cannot be appended as if they were all of them
+        if not isinstance(buffer, RollingResults):
+            raise ValueError("The checkpoint was saved with retention_window; restore it with one too")
+        buffer.restore(json.loads(str(arrays[f"{prefix}.retention"])), arrays[f"{prefix}.steps"], columns)
+        return
+    flushed = int(arrays.get(f"{prefix}.flushed", 0))
+    if getattr(buffer, "sink", None) is not None and flushed:
+        buffer.flushed = buffer.sink.resume(flushed)
+        columns = {name: values[buffer.flushed:] for name, values in columns.items()}
+    if len(next(iter(columns.values()))):
+        buffer.extend(columns)
+
+def recorder_arrays(recorder):
+    return {"states/initial": recorder.initial, "states/current": recorder.current, **buffer_arrays("transitions", recorder.log)}
+
+def restore_recorder(arrays, steps, sink=None, flush_every=None):
+    recorder = AgentStateRecorder(arrays["states/initial"], sink=sink, flush_every=flush_every)
+    restore_buffer(recorder.log, "transitions", arrays)
+    recorder.current = arrays["states/current"].copy()
+    recorder.steps = steps
+    return recorder
+
+
+class StoredGraph:
+    """Stands in for a GraphCache holding one graph, so a model restored from a checkpoint takes the saved CSR arrays instead of generating its graph again."""
+
+    def __init__(self, indptr, indices):
+        self.indptr = indptr
+        self.indices = indices
+
+    def get_or_create(self, graph_type, N, m_value, p_value, seed, build, backend='networkx'):
+        return self.indptr, self.indices
@@ -0,0 +1,75 @@
+const DeltaNetworkModule = function (canvas_width, canvas_height) {
+  const canvas = document.createElement("canvas");
+  Object.assign(canvas, {
+    width: canvas_width,
+    height: canvas_height,
+    style: "border:1px dotted",
+  });
+  document.getElementById("elements").appendChild(canvas);
+  const context = canvas.getContext("2d");
+
+  // The edges never change, so they are drawn once onto a background canvas that is copied in on every frame
+  const background = document.createElement("canvas");
+  Object.assign(background, { width: canvas_width, height: canvas_height });
+
+  const margin = 10;
+  const radius = 3;
+  let x = [];
+  let y = [];
+  let states = [];
+  let colors = [];
+
+  const setTopology = (data) => {
+    const width = canvas_width - 2 * margin;
+    const height = canvas_height - 2 * margin;
+    x = data.x.map((value) => margin + value * width);
+    y = data.y.map((value) => margin + value * height);
+    states = data.states;
+    colors = data.colors;
+
+    const context = background.getContext("2d");
+    context.clearRect(0, 0, canvas_width, canvas_height);
+    context.strokeStyle = "black";
+    context.lineWidth = 0.6;
+    context.beginPath();
+    for (let i = 0; i < data.edges.length; i += 2) {
+      const source = data.edges[i];
+      const target = data.edges[i + 1];
+      context.moveTo(x[source], y[source]);
+      context.lineTo(x[target], y[target]);
+    }
+    context.stroke();
+  };
+
+  const draw = () => {
+    context.clearRect(0, 0, canvas_width, canvas_height);
+    context.drawImage(background, 0, 0);
+    // One path per colour instead of one per node
+    for (let color = 0; color < colors.length; color++) {
+      context.fillStyle = colors[color];
+      context.beginPath();
+      for (let node = 0; node < states.length; node++) {
+        if (states[node] === color) {
+          context.moveTo(x[node] + radius, y[node]);
+          context.arc(x[node], y[node], radius, 0, 2 * Math.PI);
+        }
+      }
+      context.fill();
+    }
+  };
+
+  this.render = (data) => {
+    if (data.states !== undefined) {
+      setTopology(data);
+    } else {
+      for (let i = 0; i < data.changes.length; i += 2) {
+        states[data.changes[i]] = data.changes[i + 1];
+      }
+    }
+    draw();
+  };
+
+  this.reset = () => {
+    context.clearRect(0, 0, canvas_width, canvas_height);
+  };
+};
@@ -0,0 +1,55 @@
+import os
+
+import mesa.visualization
+import networkx as nx
+import numpy as np
+
+from NetworkRenderer import node_ranks, rank_names
+
+
+class DeltaNetworkModule(mesa.visualization.VisualizationElement):
+    """Network view that sends the graph to the browser once per model, and after that only the nodes whose colour changed."""
+
+    local_includes = ["DeltaNetworkModule.js"]
+    local_dir = os.path.dirname(os.path.abspath(__file__))
+
+    def __init__(self, canvas_height=500, canvas_width=500, max_edges=5000, layout=None):
+        #Graphs with more than max_edges edges only have a fixed random sample of them drawn (None draws them all)
+        #layout(G) returns {node: (x, y)}; by default a spring layout, with fewer iterations on large graphs as it is O(N^2) per iteration
+        self.canvas_height = canvas_height
+        self.canvas_width = canvas_width
+        self.max_edges = max_edges
+        self.layout = layout
+        self.js_code = f"elements.push(new DeltaNetworkModule({canvas_width}, {canvas_height}));"
+        self.model = None
+        self.sent = None
+
+    def topology(self, model):
+        G = model.G
+        if self.layout is not None:
+            pos = self.layout(G)
+        else:
+            pos = nx.spring_layout(G, seed=0, iterations=50 if G.number_of_nodes() <= 1000 else 15)
+        xy = np.array([pos[node] for node in range(G.number_of_nodes())])
+        #Scaled to [0, 1] here so the browser only has to multiply by the canvas size
+        xy = (xy - xy.min(axis=0)) / np.maximum(np.ptp(xy, axis=0), 1e-12)
+        edges = np.array(G.edges, dtype=np.int64).reshape(-1, 2)
+        if self.max_edges is not None and len(edges) > self.max_edges:
+            edges = edges[np.sort(np.random.default_rng(0).choice(len(edges), self.max_edges, replace=False))]
+        return {"x": np.round(xy[:, 0], 4).tolist(), "y": np.round(xy[:, 1], 4).tolist(), "edges": edges.ravel().tolist(), "colors": rank_names}
+
+    def render(self, model):
+        if model.state_recorder is None:
+            #No agents yet, every node is empty
+            ranks = np.zeros(model.num_nodes, dtype=np.int64)
+        else:
+            ranks = node_ranks(model.state_recorder.current, model.agent_positions(), model.num_nodes)
+        if model is not self.model:
+            #A new model (the server was reset): send everything
+            self.model = model
+            self.sent = ranks
+            return {**self.topology(model), "states": ranks.tolist()}
+        changed = np.flatnonzero(ranks != self.sent)
+        self.sent = ranks
+        #Flattened (node, colour index) pairs
+        return {"changes": np.column_stack([changed, ranks[changed]]).ravel().tolist()}
@@ -0,0 +1,72 @@
+import numpy as np
+
+#The risk multipliers that define the prevalence strata. An agent is in a stratum while its multiplier is not 1.
+risk_factors = (
+    "increase_age_risk",
+    "increase_genetic_risk",
+    "increase_tobacco_use",
+    "increase_unhealthy_diet",
+    "increase_physical_activity",
+    "increase_alcohol_use",
+    "increase_lifestyle_risk",
+)
+
+
+class EpidemicCounters:
+    """Running S/I/R and per-stratum counts, kept up to date on every agent state transition."""
+
+    def __init__(self, num_recoveries_for_immune):
+        self.num_recoveries_for_immune = num_recoveries_for_immune
+        self.infected = 0
+        self.recovered = 0
+        self.susceptible = 0
+        self.at_risk = [0] * len(risk_factors)
+        self.at_risk_infected = [0] * len(risk_factors)
+
+    #Callers discard an agent before changing its state and add it back afterwards, so each transition costs O(1)
+    def add(self, agent, sign=1):
+        infected = agent.wealth == 1 and agent.recovered == 0
+        if infected:
+            self.infected += sign
+        if agent.recovered == 1:
+            self.recovered += sign
+        if agent.wealth == 0 and agent.num_recoveries < self.num_recoveries_for_immune:
+            self.susceptible += sign
+        for k, factor in enumerate(risk_factors):
+            if getattr(agent, factor) != 1:
+                self.at_risk[k] += sign
+                if infected:
+                    self.at_risk_infected[k] += sign
+
+    def discard(self, agent):
+        self.add(agent, -1)
+
+    #The same as add/discard, for the agents at positions `index` of an array-backed population (see NetworkArrayEngine)
+    def add_many(self, population, index, sign=1):
+        wealth = population.wealth[index]
+        recovered = population.recovered[index]
+        infected = (wealth == 1) & (recovered == 0)
+        self.infected += sign * int(infected.sum())
+        self.recovered += sign * int((recovered == 1).sum())
+        self.susceptible += sign * int(((wealth == 0) & (population.num_recoveries[index] < self.num_recoveries_for_immune)).sum())
+        for k, factor in enumerate(risk_factors):
+            at_risk = getattr(population, factor)[index] != 1
+            self.at_risk[k] += sign * int(at_risk.sum())
+            self.at_risk_infected[k] += sign * int((at_risk & infected).sum())
+
+    def discard_many(self, population, index):
+        self.add_many(population, index, -1)
+
+    def merge(self, other):
+        #Adds the counts of `other`, e.g. the changes that one partition of the population made during a step (see PartitionedEngine)
+        self.infected += other.infected
+        self.recovered += other.recovered
+        self.susceptible += other.susceptible
+        self.at_risk = [a + b for a, b in zip(self.at_risk, other.at_risk)]
+        self.at_risk_infected = [a + b for a, b in zip(self.at_risk_infected, other.at_risk_infected)]
+
+    def prevalence(self, factor):
+        k = risk_factors.index(factor)
+        if self.at_risk[k] == 0:
+            return float('nan')
+        return self.at_risk_infected[k]/self.at_risk[k]
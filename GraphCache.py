@@ -0,0 +1,84 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+
+class GraphCache:
+    """On-disk store of contact graphs as CSR arrays, memory-mapped back in and evicted least-recently-used first."""
+
+    def __init__(self, directory, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    #The backend that generated a graph is part of its key, since the native generators give other graphs for the same seed (see GraphGenerators)
+    def path(self, graph_type, N, m_value, p_value, seed, backend='networkx'):
+        key = repr((graph_type, int(N), m_value, p_value, int(seed)) + (() if backend == 'networkx' else (backend,)))
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, graph_type, N, m_value, p_value, seed, backend='networkx'):
+        path = self.path(graph_type, N, m_value, p_value, seed, backend)
+        try:
+            #Memory-mapped read-only, so every process that loads the same graph shares one copy through the page cache
+            indptr = np.load(os.path.join(path, "indptr.npy"), mmap_mode='r')
+            indices = np.load(os.path.join(path, "indices.npy"), mmap_mode='r')
+        except FileNotFoundError:
+            return None
+        #The directory's modification time is the entry's last use
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return indptr, indices
+
+    def put(self, graph_type, N, m_value, p_value, seed, indptr, indices, backend='networkx'):
+        path = self.path(graph_type, N, m_value, p_value, seed, backend)
+        dtype = np.int32 if len(indices) < 2**31 and N < 2**31 else np.int64
+        #Written to a temporary directory and renamed into place, so a reader never sees a half-written entry
+        tmp = tempfile.mkdtemp(dir=self.directory, prefix=".tmp-")
+        np.save(os.path.join(tmp, "indptr.npy"), np.asarray(indptr, dtype=dtype))
+        np.save(os.path.join(tmp, "indices.npy"), np.asarray(indices, dtype=dtype))
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            #Another process stored the same graph first
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict(keep=path)
+        return self.get(graph_type, N, m_value, p_value, seed, backend)
+
+    def get_or_create(self, graph_type, N, m_value, p_value, seed, build, backend='networkx'):
+        #build() is only called on a miss, and returns the (indptr, indices) to store
+        cached = self.get(graph_type, N, m_value, p_value, seed, backend)
+        if cached is not None:
+            return cached
+        indptr, indices = build()
+        return self.put(graph_type, N, m_value, p_value, seed, indptr, indices, backend)
+
+    def entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(".tmp-") or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                entries.append((os.path.getmtime(path), size, path))
+            except FileNotFoundError:
+                continue
+        return entries
+
+    def evict(self, keep=None):
+        if self.max_bytes is None:
+            return
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
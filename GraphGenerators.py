@@ -0,0 +1,178 @@
+import random
+
+import numpy as np
+
+#Array-based versions of the four networkx generators that generate_graph uses, returning the CSR adjacency (indptr, indices) that graph_to_csr would give, without building a networkx graph.
+#They follow the same random processes, so the graphs have the same distribution, but not the same draws: a seed gives a different graph than networkx gives for it.
+
+
+def edges_to_csr(n, sources, targets):
+    #CSR adjacency of the undirected simple graph with these edges, neighbours sorted; repeated edges are merged
+    keys = np.unique(np.concatenate([sources * n + targets, targets * n + sources]))
+    rows, indices = np.divmod(keys, n)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+    return indptr, indices.astype(np.int64)
+
+def duplicate_entries(rows):
+    #Mask of the entries that repeat an earlier entry of the same row
+    order = np.argsort(rows, axis=1, kind='stable')
+    ordered = np.take_along_axis(rows, order, axis=1)
+    repeated = np.zeros(rows.shape, dtype=bool)
+    np.put_along_axis(repeated, order[:, 1:], ordered[:, 1:] == ordered[:, :-1], axis=1)
+    return repeated
+
+def barabasi_albert_csr(n, m, rng):
+    #Preferential attachment from a star on nodes 0..m, as networkx does. Each new node picks m distinct targets, each one an endpoint chosen uniformly from all earlier edges, which is choosing a node proportionally to its degree.
+    #Edge e has endpoint slots 2e (its source) and 2e + 1 (its target), so the repeated-endpoint list is never built: a target is a random earlier slot, and a target slot points at the slot it was drawn from until it reaches a source or a star leaf.
+    if m < 1 or m >= n:
+        raise ValueError(f"Barabasi Albert needs 1 <= m < N, got m={m}, N={n}")
+    new_edges = (n - m - 1) * m
+    node = np.repeat(np.arange(m + 1, n), m)
+    #Slots of the edges that came before each new node's edges
+    earlier = 2 * m * (node - m)
+
+    def endpoint(slots):
+        edge = slots // 2
+        return np.where(slots % 2 == 0, np.where(edge < m, 0, m + 1 + (edge - m) // m), edge + 1)
+
+    slot = np.floor(rng.random(new_edges) * earlier).astype(np.int64)
+    while True:
+        #Follow target slots of new edges back to the slot they were drawn from, for the whole population at once
+        resolved = slot.copy()
+        pending = np.flatnonzero((resolved % 2 == 1) & (resolved // 2 >= m))
+        while len(pending):
+            resolved[pending] = slot[resolved[pending] // 2 - m]
+            pending = pending[(resolved[pending] % 2 == 1) & (resolved[pending] // 2 >= m)]
+        targets = endpoint(resolved)
+        #A node's targets must be distinct; repeats are drawn again, which also changes every target that was drawn from them
+        redraw = np.flatnonzero(duplicate_entries(targets.reshape(-1, m)).ravel())
+        if len(redraw) == 0:
+            break
+        slot[redraw] = np.floor(rng.random(len(redraw)) * earlier[redraw]).astype(np.int64)
+    sources = np.concatenate([np.zeros(m, dtype=np.int64), node])
+    targets = np.concatenate([np.arange(1, m + 1), targets])
+    return edges_to_csr(n, sources, targets)
+
+def watts_strogatz_csr(n, k, p, rng):
+    #Ring lattice where every node is joined to its k // 2 nearest nodes on each side, after which each edge (u, v) is rewired with probability p to (u, w) for a uniformly chosen w that is not u and not already a neighbour of u
+    if k > n:
+        raise ValueError(f"Watts Strogatz needs k <= N, got k={k}, N={n}")
+    if k == n:
+        source, target = np.triu_indices(n, 1)
+        return edges_to_csr(n, source.astype(np.int64), target.astype(np.int64))
+    sources = np.tile(np.arange(n, dtype=np.int64), k // 2)
+    targets = (sources + np.repeat(np.arange(1, k // 2 + 1), n)) % n
+    #When every node already neighbours all others there is nothing to rewire to
+    rewire = np.flatnonzero(rng.random(len(sources)) < p) if k < n - 1 else np.zeros(0, dtype=np.int64)
+    keep = np.ones(len(sources), dtype=bool)
+    keep[rewire] = False
+    taken = np.sort(np.concatenate([sources[keep] * n + targets[keep], targets[keep] * n + sources[keep]]))
+    #Each round draws a new endpoint for every edge still to rewire; one that lands on u, on an edge already taken, or on the same pair as another edge of the round is drawn again next round.
+    #The rounds are capped, after which an edge stays where it was, as networkx leaves the edges of a node that cannot gain neighbours.
+    for attempt in range(100):
+        if len(rewire) == 0:
+            break
+        u = sources[rewire]
+        w = rng.integers(n, size=len(rewire))
+        keys = u * n + w
+        found = np.minimum(np.searchsorted(taken, keys), len(taken) - 1)
+        clash = (w == u) | (taken[found] == keys)
+        _, first = np.unique(np.minimum(u, w) * n + np.maximum(u, w), return_index=True)
+        unique = np.zeros(len(rewire), dtype=bool)
+        unique[first] = True
+        accept = ~clash & unique
+        targets[rewire[accept]] = w[accept]
+        taken = np.sort(np.concatenate([taken, keys[accept], w[accept] * n + u[accept]]))
+        rewire = rewire[~accept]
+    return edges_to_csr(n, sources, targets)
+
+def triangle_index(pairs):
+    #The (v, w), w < v, of each position in the enumeration (1, 0), (2, 0), (2, 1), (3, 0), ... of node pairs
+    v = np.floor((1 + np.sqrt(1 + 8 * pairs.astype(np.float64))) / 2).astype(np.int64)
+    #Corrects the float rounding of the square root for very large positions
+    v -= v * (v - 1) // 2 > pairs
+    v += (v + 1) * v // 2 <= pairs
+    return v, pairs - v * (v - 1) // 2
+
+def erdos_renyi_csr(n, p, rng):
+    #Every pair of nodes is an edge with probability p. The gaps between successive edges in the enumeration of all pairs are geometric, so only the edges are visited, in O(N + edges) instead of O(N^2).
+    total = n * (n - 1) // 2
+    if p <= 0 or total == 0:
+        return edges_to_csr(n, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+    if p >= 1:
+        pairs = np.arange(total, dtype=np.int64)
+    else:
+        chunks = []
+        last = -1
+        while last < total:
+            #Enough gaps to most likely cover the remaining pairs in one go
+            expected = (total - last) * p
+            gaps = rng.geometric(p, size=int(expected + 5 * np.sqrt(expected) + 16))
+            positions = last + np.cumsum(gaps)
+            chunks.append(positions[positions < total])
+            last = positions[-1]
+        pairs = np.concatenate(chunks)
+    v, w = triangle_index(pairs)
+    return edges_to_csr(n, v, w)
+
+def powerlaw_cluster_csr(n, m, p, rng):
+    #Holme and Kim's preferential attachment with triad closure, as networkx's powerlaw_cluster_graph: each new node attaches to a target chosen by degree, then each of its other m - 1 edges closes a triangle with a random neighbour of that target with probability p, and otherwise attaches by degree as well.
+    #The process depends on the graph as it grows, so it runs node by node, on adjacency lists rather than a networkx graph.
+    if m < 1 or n < m:
+        raise ValueError(f"Power Law Cluster needs 1 <= m <= N, got m={m}, N={n}")
+    if p > 1 or p < 0:
+        raise ValueError(f"Power Law Cluster needs 0 <= p <= 1, got p={p}")
+    draw = random.Random(int(rng.integers(2**63)))
+    adjacency = [[] for i in range(n)]
+    repeated_nodes = list(range(m))
+    sources = []
+    targets = []
+    for source in range(m, n):
+        #m distinct nodes, chosen by degree, and taken in set order as networkx does
+        possible_targets = set()
+        while len(possible_targets) < m:
+            possible_targets.add(draw.choice(repeated_nodes))
+        target = possible_targets.pop()
+        linked = [target]
+        while len(linked) < m:
+            if draw.random() < p:
+                #A uniform neighbour of the target that source is not linked to yet. Hubs have long lists, so a few random picks are tried before the list is filtered; either way the pick is uniform over the allowed neighbours.
+                neighbours = adjacency[target]
+                nbr = None
+                for attempt in range(4 if neighbours else 0):
+                    candidate = draw.choice(neighbours)
+                    if candidate not in linked:
+                        nbr = candidate
+                        break
+                else:
+                    neighborhood = [candidate for candidate in neighbours if candidate not in linked]
+                    if neighborhood:
+                        nbr = draw.choice(neighborhood)
+                if nbr is not None:
+                    linked.append(nbr)
+                    continue
+            target = possible_targets.pop()
+            linked.append(target)
+        #A node that was both closed into a triangle and picked by degree is linked once, as networkx merges the repeated edge
+        for nbr in dict.fromkeys(linked):
+            adjacency[source].append(nbr)
+            adjacency[nbr].append(source)
+        repeated_nodes.extend(linked)
+        repeated_nodes.extend([source] * m)
+        sources.extend([source] * m)
+        targets.extend(linked)
+    return edges_to_csr(n, np.array(sources, dtype=np.int64), np.array(targets, dtype=np.int64))
+
+def generate_csr(graph_type, N, m_value, p_value, seed=None):
+    #The CSR counterpart of NetworkModel.generate_graph, with the same parameters
+    rng = np.random.default_rng(seed)
+    if graph_type == 'Barabasi Albert':
+        return barabasi_albert_csr(N, m_value, rng)
+    elif graph_type == 'Watts Strogatz':
+        return watts_strogatz_csr(N, 6, p_value/10, rng)
+    elif graph_type == 'Erdos Renyi':
+        return erdos_renyi_csr(N, p_value/10, rng)
+    elif graph_type == 'Power Law Cluster':
+        return powerlaw_cluster_csr(N, m_value, p_value/10, rng)
+    raise ValueError(f"Unknown graph type {graph_type!r}")
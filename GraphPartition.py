@@ -0,0 +1,54 @@
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.csgraph
+
+#Splits a graph, given as its CSR adjacency, into parts of about equal weight with few edges between them, for running the parts side by side (see PartitionedEngine).
+#'metis' uses METIS through pymetis, which is optional. 'bfs' cuts a breadth-first (reverse Cuthill-McKee) ordering of the nodes into consecutive runs; the ordering keeps neighbours close together, so few edges span two runs. 'auto' takes METIS when pymetis is installed.
+
+
+def partition_graph(indptr, indices, parts, weights=None, method='auto'):
+    #The part (0..parts - 1) of every node; `weights` are non-negative node weights, by default all 1
+    indptr = np.asarray(indptr)
+    indices = np.asarray(indices)
+    n = len(indptr) - 1
+    weights = np.ones(n, dtype=np.int64) if weights is None else np.asarray(weights, dtype=np.int64)
+    if method not in ('auto', 'bfs', 'metis'):
+        raise ValueError(f"Unknown partitioner {method!r}, expected 'auto', 'bfs' or 'metis'")
+    if parts < 1:
+        raise ValueError(f"Need at least one part, got {parts}")
+    if parts == 1 or n == 0:
+        return np.zeros(n, dtype=np.int64)
+    if method == 'auto':
+        try:
+            import pymetis
+            method = 'metis'
+        except ImportError:
+            method = 'bfs'
+    if method == 'metis':
+        return metis_partition(indptr, indices, parts, weights)
+    return bfs_partition(indptr, indices, parts, weights)
+
+def metis_partition(indptr, indices, parts, weights):
+    import pymetis
+    #Older pymetis releases take the CSR arrays directly
+    if hasattr(pymetis, "CSRAdjacency"):
+        result = pymetis.part_graph(parts, adjacency=pymetis.CSRAdjacency(indptr, indices), vweights=weights)
+    else:
+        result = pymetis.part_graph(parts, xadj=indptr, adjncy=indices, vweights=weights)
+    return np.asarray(result[1], dtype=np.int64)
+
+def bfs_partition(indptr, indices, parts, weights):
+    n = len(indptr) - 1
+    A = sp.csr_array((np.ones(len(indices), dtype=np.int8), indices, indptr), shape=(n, n))
+    order = scipy.sparse.csgraph.reverse_cuthill_mckee(A, symmetric_mode=True)
+    #Each run ends where the running weight passes its share of the total
+    cumulative = np.cumsum(weights[order])
+    boundaries = np.searchsorted(cumulative, cumulative[-1] * np.arange(1, parts) / parts, side='right')
+    membership = np.empty(n, dtype=np.int64)
+    membership[order] = np.repeat(np.arange(parts), np.diff(np.concatenate(([0], boundaries, [n]))))
+    return membership
+
+def edge_cut(indptr, indices, membership):
+    #The number of edges between different parts
+    rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    return int((membership[rows] != membership[indices]).sum()) // 2
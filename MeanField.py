@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+import scipy.integrate
+
+from NetworkArrayEngine import graph_to_csr
+
+
+def contact_classes(indptr, indices, ball):
+    #Agents move to a uniformly random node of their neighborhood (the `ball` sizes, see NeighborhoodIndex.sizes) every step, so in the long run the share of agents on node n is proportional to the size of its ball.
+    #An infector on node n meets the agents on n's neighbours: c(n) of them on average. Returns the distinct contact counts and the share of infectors that sees each one.
+    n = len(indptr) - 1
+    ball = np.asarray(ball, dtype=np.float64)
+    if ball.sum() == 0:
+        return np.zeros(1), np.ones(1)
+    occupancy = n * ball / ball.sum()
+    contacts = np.add.reduceat(occupancy[indices], indptr[:-1]) if len(indices) else np.zeros(n)
+    contacts[np.diff(indptr) == 0] = 0
+    contacts, inverse = np.unique(np.round(contacts, 3), return_inverse=True)
+    weights = np.bincount(inverse, weights=ball / ball.sum(), minlength=len(contacts))
+    return contacts, weights
+
+def mean_field(model, num_ticks):
+    #Degree-class mean-field approximation of NetworkModel (the SIRS-with-immunity dynamics of NetworkAgent.step), integrated as an ODE in steps.
+    #Returns a frame with the columns of results_df and one row per step; counts are expected values, so they are not whole numbers.
+    #Compartments are split by age risk (a = 0, 1) and by number of past recoveries j, since both change an agent's susceptibility and vaccination. The other risk factors enter through their population means.
+    N = model.num_nodes
+    R = model.num_recoveries_for_immune
+    J = max(R, 1)
+    indptr, indices = model.adjacency if model.adjacency is not None else graph_to_csr(model.G)
+    contacts, weights = contact_classes(np.asarray(indptr), np.asarray(indices), model.neighborhood.sizes())
+
+    p_age = model.age_risk_proportion/100
+    p_genetic = model.genetic_risk_proportion/100
+    p_tobacco, p_diet, p_activity, p_alcohol = (model.tobacco_risk_proportion/100, model.unhealthy_diet_proportion/100,
+                                               model.physical_activity_proportion/100, model.alcohol_use_proportion/100)
+    genetic = 1 + 0.2*p_genetic
+    #The lifestyle multiplier is only set for agents with the alcohol risk factor (see NetworkAgent.__init__)
+    lifestyle_given = lambda tobacco, diet, activity: 1.2 * model.income_multiplier * tobacco * diet * activity
+    lifestyle_alcohol = lifestyle_given(1 + 0.2*p_tobacco, 1 + 0.2*p_diet, 1 + 0.2*p_activity)
+    lifestyle = 1 + p_alcohol*(lifestyle_alcohol - 1)
+
+    #Per-compartment susceptibility: the chance of infection per contact, times the chance of getting past the vaccine
+    efficacy = model.vaccination_efficacy
+    rate = model.vaccination_rate/100
+    v0 = efficacy * np.clip(np.ceil(model.vaccination_rate * N) - 1, 0, N) / N
+    sigma = np.zeros((2, J))
+    for j in range(R):
+        #Age risk: the chance of infection drops by a quarter per recovery, and recovery re-vaccinates at 35% effectiveness
+        v_age = 0.35*efficacy + (v0 - 0.35*efficacy) * (1 - rate)**j
+        sigma[1, j] = model.chance_of_infection/100 * 0.75**j * 1.2 * genetic * lifestyle * (1 - v_age)
+        #No age risk: the age multiplier is halved at the first recovery, after which recovery no longer changes the vaccination
+        sigma[0, j] = model.chance_of_infection/100 * (1 if j == 0 else 0.5) * genetic * lifestyle * (1 - v0)
+    sigma = np.minimum(sigma, 1).ravel()
+
+    #An infection lasts num_steps steps, so the infected are passed through num_steps stages of one step on average each (an Erlang-distributed duration) rather than recovering at a constant rate
+    D = max(model.num_steps, 1)
+    #State: S (2 x J), I (2 x J x D), immune (2), cumulative infections, cumulative recoveries
+    size = 2*J
+    def unpack(y):
+        return y[:size], y[size:size + size*D].reshape((size, D) + y.shape[1:]), y[size + size*D:size + size*D + 2], y[-2], y[-1]
+
+    #Where recovery from I[a, j] leads: S[a, j + 1], or immunity after the R-th recovery
+    to_susceptible = np.array([j + 1 < R for a in range(2) for j in range(J)])
+
+    def derivatives(t, y):
+        S, I, immune, cases, recoveries = unpack(y)
+        pressure = sigma * S
+        phi = min(pressure.sum() / N, 1.0)
+        #Each infector stops at its first successful contact, so it causes at most one infection per step.
+        #The model steps in discrete time, where the infected grow by a factor (1 + per_infector) per step; the ODE rate log(1 + per_infector) grows them by the same factor.
+        per_infector = np.log1p(np.dot(weights, 1 - (1 - phi)**contacts))
+        flow = I.sum() * per_infector * pressure / pressure.sum() if phi > 0 else np.zeros(size)
+        dI = -I.copy()
+        dI[:, 1:] += I[:, :-1]
+        dI[:, 0] += flow
+        recovered = I[:, -1]
+        dS = -flow
+        dS[1:] += np.where(to_susceptible, recovered, 0)[:-1]
+        dimmune = np.array([recovered[:J][~to_susceptible[:J]].sum(), recovered[J:][~to_susceptible[J:]].sum()])
+        return np.concatenate([dS, dI.ravel(), dimmune, [flow.sum(), recovered.sum()]])
+
+    y0 = np.zeros(size + size*D + 4)
+    S0, I0 = y0[:size], y0[size:size + size*D].reshape(size, D)
+    S0[0], S0[J] = (N - 1) * (1 - p_age), (N - 1) * p_age
+    I0[0, 0], I0[J, 0] = 1 - p_age, p_age
+    times = np.arange(max(num_ticks, 1))
+    solution = scipy.integrate.solve_ivp(derivatives, (0, times[-1]), y0, t_eval=times, method='LSODA', rtol=1e-6, atol=1e-9)
+    S, I, immune, cases, recoveries = unpack(solution.y)
+    I = I.sum(axis=1)
+
+    susceptible_j = np.array([j < R for a in range(2) for j in range(J)])
+    recovered_j = np.array([j >= 1 for a in range(2) for j in range(J)])
+    infected = I.sum(axis=0)
+    prevalence = infected / N
+    #The age stratum holds everyone with age risk, and everyone without it who has recovered once (their multiplier was halved)
+    age_at_risk = N*p_age + S[recovered_j & (np.arange(size) < J)].sum(axis=0) + I[recovered_j & (np.arange(size) < J)].sum(axis=0) + immune[0]
+    age_infected = I[J:].sum(axis=0) + I[1:J].sum(axis=0)
+    #For the other factors, prevalence in the stratum is scaled by its susceptibility relative to the population mean
+    def stratum(proportion, ratio):
+        if proportion == 0:
+            return np.full(len(times), np.nan)
+        return np.minimum(prevalence * ratio, 1)
+    lifestyle_with = lambda tobacco, diet, activity: 1 + p_alcohol*(lifestyle_given(tobacco, diet, activity) - 1)
+
+    columns = {
+        "Total Infections": infected,
+        "Prevalence": prevalence,
+        "Incidence": np.diff(cases, prepend=cases[0]) / N,
+        "Susceptible": S[susceptible_j].sum(axis=0),
+        "Infected": infected,
+        "Recovered": S[recovered_j].sum(axis=0) + immune.sum(axis=0),
+        "Vaccinations": recoveries * rate,
+        "Prevalence - Age Risk": np.where(age_at_risk > 0, age_infected / np.maximum(age_at_risk, 1e-300), np.nan),
+        "Prevalence - Genetic Risk": stratum(p_genetic, 1.2 / genetic),
+        "Prevalence - Tobacco": stratum(p_tobacco, lifestyle_with(1.2, 1 + 0.2*p_diet, 1 + 0.2*p_activity) / lifestyle),
+        "Prevalence - Diet": stratum(p_diet, lifestyle_with(1 + 0.2*p_tobacco, 1.2, 1 + 0.2*p_activity) / lifestyle),
+        "Prevalence - Physical Activity": stratum(p_activity, lifestyle_with(1 + 0.2*p_tobacco, 1 + 0.2*p_diet, 1.2) / lifestyle),
+        "Prevalence - Alcohol Use": stratum(p_alcohol, lifestyle_alcohol / lifestyle),
+        "Prevalence - Lifestyle Risk": stratum(p_alcohol, lifestyle_alcohol / lifestyle),
+    }
+    return pd.DataFrame(columns).iloc[:num_ticks].reset_index(drop=True)
@@ -0,0 +1,110 @@
+import numpy as np
+
+from AgentStateRecorder import SUSCEPTIBLE, INFECTED, RECOVERED, DEAD
+
+#The eight Moore-neighbourhood moves, and the nine cells (own cell included) an agent can pick its contact from
+moore_moves = np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if (dx, dy) != (0, 0)])
+moore_block = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+
+
+class MoneyArrayEngine:
+    """Array-backed alternative to the MoneyAgent population of a MoneyModel, on the same toroidal grid, which updates every agent at once."""
+
+    #The update is synchronous: every living agent moves, then the agents that were infected at the start of the step pick their contacts on the new positions, then deaths, then the zones.
+    #The RandomActivation schedule steps the MoneyAgents one after another in a shuffled order instead, so there an agent infected earlier in the step passes it on in that same step, contacts are picked among agents that have and have not moved yet, and the dead are gone for the rest of the step.
+    #The per-agent rules are the same but the dynamics are not: the epidemic grows a little more slowly and peaks later and lower than with engine='agents'. Compare runs made with the same engine.
+
+    def __init__(self, model, width, height):
+        self.model = model
+        self.width = width
+        self.height = height
+        self.rng = np.random.default_rng(model.random.getrandbits(64))
+
+        n = model.num_agents
+        self.x = self.rng.integers(width, size=n)
+        self.y = self.rng.integers(height, size=n)
+        #Dead agents stay in the arrays and are masked out, instead of being removed from a schedule and a grid
+        self.alive = np.ones(n, dtype=bool)
+        self.wealth = np.zeros(n, dtype=np.int64)
+        self.steps = np.zeros(n, dtype=np.int64)
+        self.recovered = np.zeros(n, dtype=np.int64)
+
+        #Risk factors, drawn with the same proportions as MoneyAgent.__init__. As there, the death risk is the model's for every agent.
+        age = self.rng.random(n) < model.age_risk/100
+        self.increase_age_risk = np.where(age, 1.2, 1.0)
+        self.increase_age_risk_death = np.where(age, 1.5, 1.0)
+        self.increase_genetic_risk = np.where(self.rng.random(n) < model.genetic_risk/100, 1.2, 1.0)
+        self.increase_lifestyle_risk = np.where(self.rng.random(n) < model.lifestyle_risk/100, 1.2, 1.0)
+        self.death_risk = np.full(n, float(model.death_risk))
+
+    def column(self, name):
+        #An agent attribute for the living agents, as the reporters see it
+        return getattr(self, name)[self.alive]
+
+    def states(self):
+        return np.where(~self.alive, DEAD, np.where(self.wealth > 0, INFECTED, np.where(self.recovered == 1, RECOVERED, SUSCEPTIBLE))).astype(np.uint8)
+
+    def move(self, agents):
+        move = moore_moves[self.rng.integers(len(moore_moves), size=len(agents))]
+        self.x[agents] = (self.x[agents] + move[:, 0]) % self.width
+        self.y[agents] = (self.y[agents] + move[:, 1]) % self.height
+
+    def give_money(self, agents, infectious):
+        #Per-cell occupancy, and the living agents sorted by cell so the agents in cell c are order[start[c]:start[c] + counts[c]]
+        cells = self.x[agents] * self.height + self.y[agents]
+        counts = np.bincount(cells, minlength=self.width * self.height)
+        order = agents[np.argsort(cells, kind='stable')]
+        start = np.cumsum(counts) - counts
+
+        #How many agents are in the 3x3 block around every cell, own cell included (what get_neighbors(include_center=True) returns)
+        grid_counts = counts.reshape(self.width, self.height)
+        block = sum(np.roll(grid_counts, (-dx, -dy), axis=(0, 1)) for dx, dy in moore_block)
+
+        sources = infectious[block[self.x[infectious], self.y[infectious]] > 1]
+        x, y = self.x[sources], self.y[sources]
+        #Each infector picks one agent uniformly from its block (possibly itself, which is never infectable), found by walking the block's cells
+        remaining = (self.rng.random(len(sources)) * block[x, y]).astype(np.int64)
+        target = np.full(len(sources), -1)
+        for dx, dy in moore_block:
+            cell = ((x + dx) % self.width) * self.height + (y + dy) % self.height
+            hit = (target == -1) & (remaining < counts[cell])
+            target[hit] = order[start[cell[hit]] + remaining[hit]]
+            remaining -= counts[cell]
+
+        risk = self.model.chance_of_infection/100 * self.increase_age_risk[target] * self.increase_genetic_risk[target] * self.increase_lifestyle_risk[target]
+        success = (self.wealth[target] < 1) & (self.recovered[target] != 1) & (self.rng.random(len(target)) <= risk)
+        #A target reached by several infectors is only infected once
+        new_cases = np.unique(target[success])
+        self.wealth[new_cases] = 1
+        self.model.new_cases += len(new_cases)
+
+    def step(self):
+        model = self.model
+        profiler = model.profiler
+        agents = np.flatnonzero(self.alive)
+        with profiler.phase("move"):
+            self.move(agents)
+
+        was_infectious = self.wealth[agents] > 0
+        infectious = agents[was_infectious]
+        if len(infectious):
+            with profiler.phase("give_money"):
+                self.give_money(agents, infectious)
+        self.steps[agents] = np.where(was_infectious, self.steps[agents] + 1, 0)
+
+        at_risk = agents[self.steps[agents] >= model.steps_to_death]
+        died = at_risk[self.rng.random(len(at_risk)) < self.death_risk[at_risk]/100]
+        self.alive[died] = False
+        model.deaths += len(died)
+
+        with profiler.phase("zones"):
+            agents = np.flatnonzero(self.alive)
+            x, y = self.x[agents], self.y[agents]
+            recover = agents[model.zones.mask("recovery_zone")[x, y] & (self.wealth[agents] == 1)]
+            self.wealth[recover] = 0
+            self.recovered[recover] = 1
+            model.new_recoveries += len(recover)
+
+            infect = agents[model.zones.mask("infectious_layer")[x, y] & (self.wealth[agents] == 0) & (self.recovered[agents] == 0)]
+            self.wealth[infect] = 1
+            model.new_cases += len(infect)
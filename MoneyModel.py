@@ -1,12 +1,13 @@
 import mesa
-import seaborn as sns
 import numpy as np
 import pandas as pd
 import random
-import matplotlib.pyplot as plt
-import matplotlib
 
-matplotlib.use('TkAgg')
+from MoneyArrayEngine import MoneyArrayEngine
+from PhaseProfiler import PhaseProfiler, NullProfiler
+from Checkpoint import save_checkpoint, load_checkpoint, random_state, set_random_state, buffer_arrays, restore_buffer, recorder_arrays, restore_recorder
+from RollingResults import RollingResults, trim_model_vars
+from AgentStateRecorder import AgentStateRecorder, SUSCEPTIBLE, INFECTED, RECOVERED, DEAD
 
 def compute_prevalence(model):
     return sum(1 for agent in model.schedule.agents if agent.wealth == 1 and agent.recovered == 0)/model.num_nodes
@@ -21,31 +22,52 @@ def compute_susceptible(model):
 def compute_deaths(model):
     return model.deaths
 
+def agent_values(model, name):
+    #One attribute of every living agent, from the scheduled MoneyAgents or from the array engine
+    if model.engine is not None:
+        return model.engine.column(name)
+    return [getattr(agent, name) for agent in model.schedule.agents]
+
 def compute_prevalence(model):
-    agent_wealths = [agent.wealth for agent in model.schedule.agents]
-    c = sum(agent_wealths)
+    agent_wealths = agent_values(model, "wealth")
+    c = np.sum(agent_wealths)
     return c/model.num_agents
 
 def compute_incidence(model):
     return model.new_cases / model.num_agents
 
 def compute_recovered(model):
-    agent_recovered = [agent.recovered for agent in model.schedule.agents]
-    r = sum(agent_recovered)
+    agent_recovered = agent_values(model, "recovered")
+    r = np.sum(agent_recovered)
     return r
 
 def compute_infected(model):
-    agent_wealths = [agent.wealth for agent in model.schedule.agents]
-    i = sum(agent_wealths)
+    agent_wealths = agent_values(model, "wealth")
+    i = np.sum(agent_wealths)
     return i
 
 def compute_susceptible(model):
-    agent_wealths = [agent.wealth for agent in model.schedule.agents]
-    agent_recovered = [agent.recovered for agent in model.schedule.agents]
-    i = sum(agent_wealths)
-    r = sum(agent_recovered)
+    agent_wealths = agent_values(model, "wealth")
+    agent_recovered = agent_values(model, "recovered")
+    i = np.sum(agent_wealths)
+    r = np.sum(agent_recovered)
     return model.num_agents-i-r
 
+def agent_state(agent):
+    #Removed agents have no position
+    if agent.pos is None:
+        return DEAD
+    if agent.wealth > 0:
+        return INFECTED
+    if agent.recovered == 1:
+        return RECOVERED
+    return SUSCEPTIBLE
+
+#The per-agent state that a checkpoint holds, named as in MoneyAgent and MoneyArrayEngine
+agent_attributes = ("x", "y", "wealth", "steps", "recovered", "increase_age_risk", "increase_age_risk_death", "increase_genetic_risk", "increase_lifestyle_risk", "death_risk")
+#These only shape the grid and the agents' initial risk factors, which a restored model takes from the checkpoint, so they cannot be overridden
+fixed_parameters = ("N", "width", "height", "age_risk", "genetic_risk", "lifestyle_risk")
+
 class MoneyAgent(mesa.Agent):
     def __init__(self, unique_id, model):
         # pass the parameters to the parent class
@@ -69,15 +91,15 @@ class MoneyAgent(mesa.Agent):
         id_list = []
         id_list.append(unique_id)
         for x in id_list:
-            if random.random() < self.model.age_risk/100:
+            if self.random.random() < self.model.age_risk/100:
                 self.increase_age_risk = 1.2
 
                 #It is apparent that the chance of death increases with age faster than the chance of infection.
 
                 self.increase_age_risk_death = 1.5
-            if random.random() < self.model.genetic_risk/100:
+            if self.random.random() < self.model.genetic_risk/100:
                 self.increase_genetic_risk = 1.2
-            if random.random() < self.model.lifestyle_risk/100:
+            if self.random.random() < self.model.lifestyle_risk/100:
                 self.increase_lifestyle_risk = 1.2
 
     def move(self):
@@ -90,56 +112,113 @@ class MoneyAgent(mesa.Agent):
         cellmates = self.model.grid.get_neighbors(self.pos, include_center=True, moore=True)
         if len(cellmates) > 1:
             other = self.random.choice(cellmates)
-            if self.wealth == 1 and other.wealth < 1 and other.recovered != 1 and random.random() <= self.model.chance_of_infection/100 * other.increase_age_risk * other.increase_genetic_risk * other.increase_lifestyle_risk:
+            if self.wealth == 1 and other.wealth < 1 and other.recovered != 1 and self.random.random() <= self.model.chance_of_infection/100 * other.increase_age_risk * other.increase_genetic_risk * other.increase_lifestyle_risk:
                 other.wealth += 1
                 self.model.new_cases += 1
 
     def in_recovery_zone(self):
-        selected_cells = self.model.recovery_layer.select_cells(condition=lambda value: value == 1.0)
-        selected_cells_clean = [(int(x), int(y)) for x, y in selected_cells]
-        pos_tuple = (self.x, self.y)
-        if pos_tuple in selected_cells_clean:
-            return True
-        else:
-            return False
+        return self.model.zones.contains("recovery_zone", (self.x, self.y))
 
     def in_infectious_zone(self):
-        selected_cells = self.model.infectious_layer.select_cells(condition=lambda value: value == 1.0)
-        selected_cells_clean = [(int(x), int(y)) for x, y in selected_cells]
-        pos_tuple = (self.x, self.y)
-        if pos_tuple in selected_cells_clean:
-            return True
-        else:
-            return False
+        return self.model.zones.contains("infectious_layer", (self.x, self.y))
 
     def step(self):
-        self.move()
+        profiler = self.model.profiler
+        with profiler.phase("move"):
+            self.move()
         if self.wealth > 0:
-            self.give_money()
+            with profiler.phase("give_money"):
+                self.give_money()
             self.steps += 1
         elif self.wealth < 1:
             self.steps = 0
         if self.steps >= self.model.steps_to_death:
             print(f"Agent {self.unique_id} at risk of death")
-            if random.random() < self.death_risk/100:
+            if self.random.random() < self.death_risk/100:
                 print(f"Agent {self.unique_id} died.")
                 self.model.schedule.remove(self)
                 self.model.grid.remove_agent(self)
                 self.model.deaths += 1
-        if self.in_recovery_zone() and self.wealth == 1:
-            self.wealth = 0
-            self.recovered = 1
-            self.model.new_recoveries += 1
-        if self.in_infectious_zone() and self.wealth == 0 and self.recovered == 0:
-            self.wealth = 1
-            self.model.new_cases += 1
+        with profiler.phase("zones"):
+            if self.in_recovery_zone() and self.wealth == 1:
+                self.wealth = 0
+                self.recovered = 1
+                self.model.new_recoveries += 1
+            if self.in_infectious_zone() and self.wealth == 0 and self.recovered == 0:
+                self.wealth = 1
+                self.model.new_cases += 1
+
+
+class ZoneLayer(mesa.space.PropertyLayer):
+    """PropertyLayer that counts the changes made through its methods, so a ZoneIndex can tell when its mask of the layer is out of date."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = 0
+
+    def set_cell(self, position, value):
+        super().set_cell(position, value)
+        self.version += 1
+
+    def set_cells(self, value, condition=None):
+        super().set_cells(value, condition)
+        self.version += 1
+
+    def modify_cell(self, position, operation, value=None):
+        super().modify_cell(position, operation, value)
+        self.version += 1
+
+    def modify_cells(self, operation, value=None, condition_function=None):
+        super().modify_cells(operation, value, condition_function)
+        self.version += 1
+
+
+class ZoneIndex:
+    """Boolean masks of the cells where each zone layer is 1.0, so zone membership is a single array lookup."""
+
+    #A mask is rebuilt when it is read after its layer changed through one of the layer's methods (see ZoneLayer) or had its data replaced. set_cell below changes the layer and the mask together, without a rebuild.
+    #A write straight into a layer's data array is not seen: call refresh after one.
+
+    def __init__(self, *layers):
+        self.layers = {layer.name: layer for layer in layers}
+        self._masks = {}
+        self._data = {}
+        self._versions = {}
+        for name in self.layers:
+            self.refresh(name)
+
+    def refresh(self, name):
+        layer = self.layers[name]
+        self._data[name] = layer.data
+        self._versions[name] = getattr(layer, "version", 0)
+        self._masks[name] = layer.data == 1.0
+
+    def mask(self, name):
+        layer = self.layers[name]
+        if getattr(layer, "version", 0) != self._versions[name] or layer.data is not self._data[name]:
+            self.refresh(name)
+        return self._masks[name]
+
+    def set_cell(self, name, position, value):
+        mask = self.mask(name)
+        layer = self.layers[name]
+        layer.set_cell(position, value)
+        mask[position] = value == 1.0
+        self._versions[name] = getattr(layer, "version", 0)
+
+    def contains(self, name, position):
+        return bool(self.mask(name)[position])
 
 
 class MoneyModel(mesa.Model):
     """A model with some number of agents."""
 
-    def __init__(self, N, recovery_size, infectious_size, chance_of_infection, width, height, age_risk, genetic_risk, lifestyle_risk, death_risk, steps_to_death):
-        super().__init__()
+    def __init__(self, N, recovery_size, infectious_size, chance_of_infection, width, height, age_risk, genetic_risk, lifestyle_risk, death_risk, steps_to_death, engine='agents', seed=None, profile=False, retention_window=None, decimate_every=1, retention_history=None, aggregates=None):
+        #The keyword arguments, saved with checkpoints (see save_checkpoint); the aggregates are objects, so pass them again to from_checkpoint
+        self.parameters = {name: value for name, value in locals().items() if name not in ('self', '__class__', 'aggregates')}
+        #self.random is seeded from `seed`, passed on explicitly since only Mesa 2 picks it up from the constructor's keywords by itself. Every draw, the agents' included, comes from it, so a fixed seed replays the run.
+        super().__init__(seed=seed)
+        self.parameters["seed"] = self._seed
         
         self.num_agents = N
         self.age_risk = age_risk
@@ -152,7 +231,7 @@ class MoneyModel(mesa.Model):
 
         self.schedule = mesa.time.RandomActivation(self)
         self.grid = mesa.space.MultiGrid(width, height, True)
-        self.recovery_layer = mesa.space.PropertyLayer(
+        self.recovery_layer = ZoneLayer(
             name = "recovery_zone",
             width = width,
             height = height,
@@ -160,7 +239,7 @@ class MoneyModel(mesa.Model):
             dtype = np.float64
         )
 
-        self.infectious_layer = mesa.space.PropertyLayer(
+        self.infectious_layer = ZoneLayer(
             name = "infectious_layer",
             width = width,
             height = height,
@@ -176,13 +255,29 @@ class MoneyModel(mesa.Model):
             for y in range(height-infectious_size, height):
                 self.infectious_layer.set_cell((x, y), 1.0)
 
+        #Change the zones through the layers' methods, or through self.zones.set_cell which also updates the mask in place (see ZoneIndex)
+        self.zones = ZoneIndex(self.recovery_layer, self.infectious_layer)
+
         self.new_cases = 0
         self.new_recoveries = 0
         self.deaths = 0
 
+        #With profile=True each phase of step() is timed per step (see PhaseProfiler and profile_df); otherwise the phases go to a NullProfiler
+        self.profiler = PhaseProfiler() if profile else NullProfiler()
+
+        #'agents' schedules one MoneyAgent each through the MultiGrid, one after another in random order. 'array' keeps their positions and state in NumPy arrays and steps everyone at once (see MoneyArrayEngine), for very large N.
+        #The two are not interchangeable: updating everyone at once is a synchronous version of the model, whose epidemics peak later and lower, so only compare results between runs of the same engine.
+        if engine not in ('agents', 'array'):
+            raise ValueError(f"Unknown engine {engine!r}, expected 'agents' or 'array'")
+        self.engine = None
+        if engine == 'array':
+            self.engine = MoneyArrayEngine(self, width, height)
+
         # Create agents
-        for i in range(self.num_agents):
+        self.population = []
+        for i in range(self.num_agents if self.engine is None else 0):
             a = MoneyAgent(i, self)
+            self.population.append(a)
             # Add the agent to the scheduler
             self.schedule.add(a)
 
@@ -198,22 +293,146 @@ class MoneyModel(mesa.Model):
                                                                  "Incidence": compute_incidence,
                                                                  "Susceptible": compute_susceptible,
                                                                  "Infected": compute_infected,
-                                                                 "Recovered": compute_recovered, "Deaths": compute_deaths},
-                                                agent_reporters={"Wealth": "wealth"})
+                                                                 "Recovered": compute_recovered, "Deaths": compute_deaths})
+        #With a retention_window the DataCollector only keeps the last retention_window steps, and results_df comes from a RollingResults instead, with a thinned sample of the older steps and aggregates over all of them (see NetworkModel)
+        self.retention_window = retention_window
+        self.results = None
+        if retention_window is not None:
+            self.results = RollingResults({"Prevalence": np.float64, "Incidence": np.float64, "Susceptible": np.int64, "Infected": np.int64, "Recovered": np.int64, "Deaths": np.int64},
+                                          retention_window, decimate_every=decimate_every, history=retention_history, aggregates=aggregates)
+
+        #Per-agent states are kept as a log of transitions (see AgentStateRecorder) rather than one DataCollector record per agent per step
+        self.state_recorder = AgentStateRecorder(self.agent_states())
+
+    def agent_states(self):
+        if self.engine is not None:
+            return self.engine.states()
+        return np.fromiter((agent_state(agent) for agent in self.population), dtype=np.uint8, count=len(self.population))
+
+    @property
+    def results_df(self):
+        if self.results is not None:
+            return self.results.to_frame()
+        return self.datacollector.get_model_vars_dataframe()
+
+    @property
+    def results_summary(self):
+        return self.results.summary() if self.results is not None else {}
+
+    @property
+    def profile_df(self):
+        return self.profiler.to_frame()
+
+    def save_checkpoint(self, path):
+        #Saves everything needed to continue this run (see Checkpoint): every agent's state and position, the zones, the counters, the random number generator states, the results and the agent-state log
+        meta = {"parameters": self.parameters, "random": random_state(self.random), "running": self.running, "new_cases": self.new_cases, "new_recoveries": self.new_recoveries,
+                "deaths": self.deaths, "schedule_steps": self.schedule.steps, "schedule_time": self.schedule.time, "recorder_steps": self.state_recorder.steps}
+        arrays = {"recovery_zone": self.recovery_layer.data, "infectious_layer": self.infectious_layer.data, **recorder_arrays(self.state_recorder)}
+        if self.results is not None:
+            arrays.update(buffer_arrays("results", self.results))
+        else:
+            arrays.update({f"results/{name}": np.asarray(values) for name, values in self.datacollector.model_vars.items()})
+        if self.engine is not None:
+            meta["engine_rng"] = self.engine.rng.bit_generator.state
+            arrays.update({name: getattr(self.engine, name) for name in agent_attributes})
+            arrays["alive"] = self.engine.alive
+        else:
+            arrays.update({name: np.array([getattr(a, name) for a in self.population]) for name in agent_attributes})
+            arrays["alive"] = np.array([a.pos is not None for a in self.population])
+            #The activation order carries over from step to step (the schedule shuffles it in place), and a cell lists its agents in the order they arrived, which decides who give_money can pick
+            arrays["schedule_order"] = np.array([a.unique_id for a in self.schedule.agents], dtype=np.int64)
+            arrays["grid_order"] = np.array([a.unique_id for contents, _ in self.grid.coord_iter() for a in contents], dtype=np.int64)
+        save_checkpoint(path, meta, arrays)
+
+    @classmethod
+    def from_checkpoint(cls, path, **overrides):
+        #A model that continues from the checkpoint at `path` exactly as the saved one would have. Keyword arguments override the saved parameters, e.g. a larger recovery_size to fork an intervention from a shared prefix.
+        #A seed override gives the branch fresh random streams instead of the saved ones. The grid size and the risk proportions cannot be overridden (see fixed_parameters).
+        fixed = [name for name in overrides if name in fixed_parameters]
+        if fixed:
+            raise ValueError(f"Cannot override {', '.join(fixed)} when restoring a checkpoint")
+        meta, arrays = load_checkpoint(path)
+        model = cls(**{**meta["parameters"], **overrides})
+        model._restore(meta, arrays, overrides)
+        return model
+
+    def _restore(self, meta, arrays, overrides):
+        self.running = meta["running"]
+        self.new_cases, self.new_recoveries, self.deaths = meta["new_cases"], meta["new_recoveries"], meta["deaths"]
+        if self.results is not None:
+            restore_buffer(self.results, "results", arrays)
+        elif "results.retention" in arrays:
+            raise ValueError("The checkpoint was saved with retention_window; restore it with one too")
+        for name in self.datacollector.model_vars:
+            self.datacollector.model_vars[name] = arrays[f"results/{name}"][-(self.retention_window or 0):].tolist()
+        #Unless their sizes were overridden, the zones are as saved, including any cells changed through zones.set_cell
+        if "recovery_size" not in overrides:
+            self.recovery_layer.data[:] = arrays["recovery_zone"]
+            self.zones.refresh("recovery_zone")
+        if "infectious_size" not in overrides:
+            self.infectious_layer.data[:] = arrays["infectious_layer"]
+            self.zones.refresh("infectious_layer")
+
+        states = {name: arrays[name] for name in agent_attributes}
+        #Every agent's death risk is the model's (see MoneyAgent.__init__)
+        if "death_risk" in overrides:
+            states["death_risk"] = np.full(len(arrays["alive"]), float(self.death_risk))
+        if self.engine is not None:
+            for name, values in states.items():
+                setattr(self.engine, name, values.astype(getattr(self.engine, name).dtype))
+            self.engine.alive = arrays["alive"].copy()
+        else:
+            for name, values in states.items():
+                for agent, value in zip(self.population, values.tolist()):
+                    setattr(agent, name, value)
+            alive = arrays["alive"]
+            schedule_order = arrays["schedule_order"] if "schedule_order" in arrays else np.flatnonzero(alive)
+            grid_order = arrays["grid_order"] if "grid_order" in arrays else np.flatnonzero(alive)
+            for agent in self.population:
+                self.grid.remove_agent(agent)
+            for i in grid_order:
+                agent = self.population[i]
+                self.grid.place_agent(agent, (agent.x, agent.y))
+            self.schedule = mesa.time.RandomActivation(self)
+            for i in schedule_order:
+                self.schedule.add(self.population[i])
+        self.schedule.steps, self.schedule.time = meta["schedule_steps"], meta["schedule_time"]
+        self.state_recorder = restore_recorder(arrays, meta["recorder_steps"])
+
+        if "seed" not in overrides:
+            set_random_state(self.random, meta["random"])
+            if self.engine is not None and "engine_rng" in meta:
+                self.engine.rng.bit_generator.state = meta["engine_rng"]
 
     def step(self):
-        self.datacollector.collect(self)
-
-        prevalence = compute_prevalence(self)
-        incidence = compute_incidence(self)
-        susceptible = compute_susceptible(self)
-        infected = compute_infected(self)
-        recovered = compute_recovered(self)
+        profiler = self.profiler
+        with profiler.phase("collect"):
+            self.datacollector.collect(self)
+            if self.results is not None:
+                self.results.append({name: values[-1] for name, values in self.datacollector.model_vars.items()})
+                trim_model_vars(self.datacollector, self.retention_window)
+
+        with profiler.phase("reporters"):
+            prevalence = compute_prevalence(self)
+            incidence = compute_incidence(self)
+            susceptible = compute_susceptible(self)
+            infected = compute_infected(self)
+            recovered = compute_recovered(self)
         #print(f"Step {self.schedule.steps}: Prevalence = {prevalence}, Incidence = {incidence}")
         #print(f"Susceptible = {susceptible}, Infected = {infected}, Recovered = {recovered}")
 
         self.new_cases = 0
-        self.schedule.step()
+        with profiler.phase("agents"):
+            if self.engine is not None:
+                self.engine.step()
+                #The schedule stays the model's clock
+                self.schedule.steps += 1
+                self.schedule.time += 1
+            else:
+                self.schedule.step()
+        with profiler.phase("record"):
+            self.state_recorder.capture(self.schedule.steps, self.agent_states())
+        profiler.end_step(self.schedule.steps)
 
         if self.schedule.steps != 1 and prevalence == 0.0:
             print("All agents have recovered. Simulation finished.")
@@ -0,0 +1,203 @@
+from collections import OrderedDict
+
+import numpy as np
+import scipy.sparse as sp
+
+from NetworkArrayEngine import expand_ranges
+
+#Peak bytes used per neighborhood entry while building rows: the boolean sparse products (5 bytes per entry each for the ball, its product with the adjacency and their sum), then the row numbers and mask
+#used to drop every node from its own row, and the index kept (4 bytes per entry)
+BUILD_BYTES = 20
+
+
+class NeighborhoodIndex:
+    """Every node's neighborhood within `radius` hops, excluding the node itself (the nodes NetworkGrid.get_neighborhood returns), for drawing a uniformly random destination without a graph search."""
+
+    #The neighborhoods are stored flat, as CSR arrays, so a draw is an offset into the node's row. Rows are built for the nodes with the smallest neighborhoods first until max_bytes is used up (None for no limit).
+    #max_bytes covers the peak memory of building the rows, BUILD_BYTES per entry of the walk-count bound, which is more than the 4 or 8 bytes per entry the index keeps afterwards.
+    #The nodes left out are the ones near hubs, whose neighborhoods can hold a large part of the graph. At radius 2 they are sampled without listing their neighborhood (see _sample_heavy);
+    #at larger radii their neighborhoods are listed when needed and kept, least recently used first out, within max_bytes as well.
+
+    def __init__(self, indptr, indices, radius=2, max_bytes=None):
+        if radius < 1:
+            raise ValueError(f"The neighborhood radius must be at least 1, got {radius}")
+        self.indptr = np.asarray(indptr)
+        self.indices = np.asarray(indices)
+        self.radius = radius
+        self.max_bytes = max_bytes
+        n = len(self.indptr) - 1
+        self.num_nodes = n
+        self.degree = np.diff(self.indptr)
+        self.dtype = np.dtype(np.int32 if n < 2**31 else np.int64)
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+
+        if radius == 1:
+            #The neighborhood is the adjacency itself
+            self.ball_indptr, self.ball_indices = self.indptr, self.indices
+            self.heavy = np.zeros(n, dtype=bool)
+            return
+
+        #The number of walks of 1..radius steps from a node bounds the size of its neighborhood, and the work of building its row
+        A = self._adjacency()
+        walks = self.degree.astype(np.float64)
+        self.bound = walks.copy()
+        for step in range(radius - 1):
+            walks = A @ walks
+            self.bound += walks
+        order = np.argsort(self.bound, kind='stable')
+        if max_bytes is None:
+            rows = order
+        else:
+            rows = order[np.cumsum(self.bound[order]) * BUILD_BYTES <= max_bytes]
+        rows = np.sort(rows)
+        self.heavy = np.ones(n, dtype=bool)
+        self.heavy[rows] = False
+
+        row, col = self._balls(A, rows)
+        sizes = np.zeros(n, dtype=np.int64)
+        sizes[rows] = np.bincount(row, minlength=len(rows))
+        self.ball_indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(sizes, out=self.ball_indptr[1:])
+        self.ball_indices = col.astype(self.dtype, copy=False)
+
+        if radius == 2 and self.heavy.any():
+            #For every node left out, the sets its radius-2 walks end in: its own neighbors, then each neighbor's neighbors, with their cumulative sizes
+            heavy = np.flatnonzero(self.heavy)
+            set_nodes = np.split(self.indices[expand_ranges(self.indptr[heavy], self.degree[heavy])], np.cumsum(self.degree[heavy])[:-1])
+            self._walk_sets = np.concatenate([np.concatenate(([v], neighbors)) for v, neighbors in zip(heavy, set_nodes)])
+            self._walk_cumulative = np.cumsum(self.degree[self._walk_sets])
+            self._walk_start = np.zeros(n, dtype=np.int64)
+            self._walk_total = np.zeros(n, dtype=np.int64)
+            first = np.concatenate(([0], np.cumsum(self.degree[heavy] + 1)[:-1]))
+            self._walk_start[heavy] = np.concatenate(([0], self._walk_cumulative))[first]
+            self._walk_total[heavy] = self._walk_cumulative[first + self.degree[heavy]] - self._walk_start[heavy]
+            #Every edge (a, b) as the key a * N + b, sorted, to look edges up by binary search. Built here rather than on first use, so processes forked from this one share it.
+            self._edge_keys = np.repeat(np.arange(n, dtype=np.int64), self.degree) * n + self.indices
+
+    def _adjacency(self):
+        n = self.num_nodes
+        #Boolean data and 32-bit indices where they fit, so the products below take 5 bytes per entry: they only need to know whether a node is reached
+        index = np.int32 if max(n, len(self.indices)) < 2**31 else np.int64
+        return sp.csr_array((np.ones(len(self.indices), dtype=bool), self.indices.astype(index), self.indptr.astype(index)), shape=(n, n))
+
+    def _balls(self, A, rows):
+        #The neighborhoods of `rows` (sorted) as (row, col) pairs, row being the position in `rows`, sorted by row and then col
+        ball = A[rows] if len(rows) < self.num_nodes else A
+        for step in range(self.radius - 1):
+            ball = ball + ball @ A
+        ball.sort_indices()
+        row = np.repeat(np.arange(len(rows), dtype=self.dtype), np.diff(ball.indptr))
+        keep = ball.indices != rows.astype(self.dtype)[row]
+        return row[keep], ball.indices[keep]
+
+    def neighborhood(self, node):
+        #The nodes within radius of `node`, sorted
+        if not self.heavy[node]:
+            return self.ball_indices[self.ball_indptr[node]:self.ball_indptr[node + 1]]
+        if node in self._cache:
+            self._cache.move_to_end(node)
+            return self._cache[node]
+        seen = np.zeros(self.num_nodes, dtype=bool)
+        seen[node] = True
+        frontier = np.array([node])
+        for step in range(self.radius):
+            reached = self.indices[expand_ranges(self.indptr[frontier], self.degree[frontier])]
+            frontier = np.unique(reached[~seen[reached]])
+            seen[frontier] = True
+        seen[node] = False
+        neighborhood = np.flatnonzero(seen)
+        if self.radius > 2 and self.max_bytes is not None:
+            self._cache[node] = neighborhood
+            self._cache_bytes += neighborhood.nbytes
+            while self._cache_bytes > self.max_bytes and len(self._cache) > 1:
+                self._cache_bytes -= self._cache.popitem(last=False)[1].nbytes
+        return neighborhood
+
+    def sizes(self):
+        #How many nodes are within radius of every node. The neighborhoods of the nodes left out are built and counted a batch of about max_bytes at a time (a neighborhood bigger than that in a batch of its own).
+        sizes = np.diff(self.ball_indptr)
+        heavy = np.flatnonzero(self.heavy)
+        if len(heavy):
+            A = self._adjacency()
+            used = np.cumsum(self.bound[heavy]) * BUILD_BYTES
+            batch = (used // max(self.max_bytes, 1)).astype(np.int64)
+            for rows in np.split(heavy, np.flatnonzero(np.diff(batch)) + 1):
+                row, col = self._balls(A, rows)
+                sizes[rows] = np.bincount(row, minlength=len(rows))
+        return sizes
+
+    def choice(self, node, random):
+        #A uniformly random node within radius of `node`, drawn with a random.Random, or None if there is none.
+        #At radius 2 and more this makes the same draw as random.choice(grid.get_neighborhood(node, radius=radius)), which lists the neighborhood sorted, except for the nodes left out at radius 2, which are sampled differently.
+        #At radius 1 get_neighborhood lists the node's neighbors in the graph's adjacency order, and this draws from them in the CSR order, so the distribution is the same but not the draw.
+        if not self.heavy[node]:
+            start = self.ball_indptr[node]
+            size = self.ball_indptr[node + 1] - start
+            if size == 0:
+                return None
+            return int(self.ball_indices[start + random.randrange(size)])
+        if self.radius == 2:
+            node = np.array([node])
+            while True:
+                destination, multiplicity = self._walk(node, np.array([random.random()]))
+                if destination[0] != node[0] and random.random() * multiplicity[0] < 1:
+                    return int(destination[0])
+        neighborhood = self.neighborhood(node)
+        return int(neighborhood[random.randrange(len(neighborhood))])
+
+    def sample(self, nodes, rng):
+        #One uniformly random node within radius of each of `nodes`, drawn with a NumPy Generator; -1 where there is none
+        destination = np.full(len(nodes), -1, dtype=np.int64)
+        start = self.ball_indptr[nodes]
+        size = self.ball_indptr[nodes + 1] - start
+        movers = np.flatnonzero((size > 0) | self.heavy[nodes])
+        draws = rng.random(len(movers))
+        light = ~self.heavy[nodes[movers]]
+        indexed = movers[light]
+        offset = np.minimum((draws[light] * size[indexed]).astype(np.int64), size[indexed] - 1)
+        destination[indexed] = self.ball_indices[start[indexed] + offset]
+        heavy = movers[~light]
+        if len(heavy) and self.radius == 2:
+            destination[heavy] = self._sample_heavy(nodes[heavy], draws[~light], rng)
+        else:
+            for i, draw in zip(heavy, draws[~light]):
+                neighborhood = self.neighborhood(nodes[i])
+                destination[i] = neighborhood[min(int(draw * len(neighborhood)), len(neighborhood) - 1)]
+        return destination
+
+    def _sample_heavy(self, nodes, draws, rng):
+        #The radius-2 neighborhood of v is the union of N(v) and N(u) for every neighbor u. A walk endpoint is drawn uniformly from these sets taken together, and accepted with probability 1 / (number of sets holding it),
+        #which makes every node of the union equally likely; v itself is always rejected. Repeated for the rejected ones until all are accepted.
+        destination = np.empty(len(nodes), dtype=np.int64)
+        pending = np.arange(len(nodes))
+        while len(pending):
+            candidate, multiplicity = self._walk(nodes[pending], draws)
+            accept = (candidate != nodes[pending]) & (rng.random(len(pending)) * multiplicity < 1)
+            destination[pending[accept]] = candidate[accept]
+            pending = pending[~accept]
+            draws = rng.random(len(pending))
+        return destination
+
+    def _walk(self, nodes, draws):
+        #The endpoints of the radius-2 walks at position draws * (number of walks) of each node's walk sets, and in how many of those sets each endpoint is
+        total = self._walk_total[nodes]
+        position = self._walk_start[nodes] + np.minimum((draws * total).astype(np.int64), total - 1)
+        entry = np.searchsorted(self._walk_cumulative, position, side='right')
+        owner = self._walk_sets[entry]
+        offset = position - (self._walk_cumulative[entry] - self.degree[owner])
+        endpoint = self.indices[self.indptr[owner] + offset]
+        return endpoint, self._has_edge(nodes, endpoint) + self._common_neighbors(nodes, endpoint)
+
+    def _has_edge(self, a, b):
+        keys = a * self.num_nodes + b
+        found = np.minimum(np.searchsorted(self._edge_keys, keys), len(self._edge_keys) - 1)
+        return self._edge_keys[found] == keys
+
+    def _common_neighbors(self, a, b):
+        #The neighbors of the lower-degree node of each pair, looked up among the other's
+        small = np.where(self.degree[a] <= self.degree[b], a, b)
+        large = np.where(self.degree[a] <= self.degree[b], b, a)
+        pair = np.repeat(np.arange(len(a)), self.degree[small])
+        neighbors = self.indices[expand_ranges(self.indptr[small], self.degree[small])]
+        return np.bincount(pair[self._has_edge(large[pair], neighbors)], minlength=len(a))
@@ -0,0 +1,156 @@
+import numpy as np
+import networkx as nx
+import scipy.sparse as sp
+
+from AgentStateRecorder import SUSCEPTIBLE, INFECTED, RECOVERED
+
+
+def graph_to_csr(G):
+    #Builds the CSR adjacency (indptr, indices) of G. The network generators label nodes 0..N-1, which is what the engine indexes by.
+    A = nx.to_scipy_sparse_array(G, nodelist=range(G.number_of_nodes()), format='csr')
+    return A.indptr.astype(np.int64), A.indices.astype(np.int64)
+
+def csr_to_graph(indptr, indices):
+    n = len(indptr) - 1
+    return nx.from_scipy_sparse_array(sp.csr_array((np.ones(len(indices), dtype=np.int8), indices, indptr), shape=(n, n)))
+
+def expand_ranges(starts, lengths):
+    #Concatenation of range(s, s + l) for every (s, l) pair, without a Python loop.
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.cumsum(lengths) - lengths
+    return np.repeat(starts - offsets, lengths) + np.arange(total)
+
+
+class NetworkArrayEngine:
+    """Array-backed alternative to the NetworkAgent population of a NetworkModel, which updates every agent at once."""
+
+    #The update is synchronous: every agent moves, then the agents that were infected at the start of the step infect others on the new positions, then the infected count their steps and recover.
+    #NetworkAgent.step runs one agent after another instead, so there an agent infected earlier in the step infects others and counts a step in that same step, and infectors meet a mix of agents that have and have not moved yet.
+    #The per-agent rules and parameters are the same, but the dynamics are not: chains of infection within a step cannot happen here, so an epidemic grows more slowly and peaks later and lower than with engine='agents'.
+    #Compare runs made with the same engine.
+
+    def __init__(self, model):
+        self.model = model
+        #Initial risk factors come from the model's agent stream, everything after that from its dynamics stream
+        self.rng = model.rng
+        agent_rng = np.random.default_rng(model.agent_random.getrandbits(64))
+
+        n = model.num_nodes
+        #A model whose graph came from a GraphCache already has the CSR arrays, and never needs the networkx graph
+        self.indptr, self.indices = model.adjacency if model.adjacency is not None else graph_to_csr(model.G)
+        self.neighborhood = model.neighborhood
+
+        #Agent i starts on node i, and corresponds to the NetworkAgent with unique_id i + 1
+        ids = np.arange(1, n + 1)
+        self.pos = np.arange(n, dtype=np.int64)
+        self.wealth = (ids < 2).astype(np.int8)
+        self.steps = np.zeros(n, dtype=np.int64)
+        self.recovered = np.zeros(n, dtype=np.int8)
+        self.num_recoveries = np.zeros(n, dtype=np.int64)
+        self.chance_of_infection = np.full(n, float(model.chance_of_infection))
+        self.vaccinated = np.where(ids < model.vaccination_rate * n, model.vaccination_efficacy, 0.0)
+
+        #Risk multipliers, drawn with the same proportions as NetworkAgent.__init__
+        self.increase_age_risk = self._risk(agent_rng, model.age_risk_proportion)
+        self.increase_genetic_risk = self._risk(agent_rng, model.genetic_risk_proportion)
+        self.increase_tobacco_use = self._risk(agent_rng, model.tobacco_risk_proportion)
+        self.increase_unhealthy_diet = self._risk(agent_rng, model.unhealthy_diet_proportion)
+        self.increase_physical_activity = self._risk(agent_rng, model.physical_activity_proportion)
+        self.increase_alcohol_use = self._risk(agent_rng, model.alcohol_use_proportion)
+        #Only agents with the alcohol risk get a combined lifestyle multiplier
+        self.increase_lifestyle_risk = np.where(
+            self.increase_alcohol_use == 1.2,
+            self.increase_tobacco_use * self.increase_unhealthy_diet * self.increase_physical_activity * self.increase_alcohol_use * model.income_multiplier,
+            1.0)
+        self.susceptibility = np.zeros(n)
+        self.update_susceptibility()
+
+    def update_susceptibility(self, agents=slice(None)):
+        #The chance of infection per contact, as NetworkAgent.update_susceptibility, refreshed for the agents whose factors changed
+        self.susceptibility[agents] = self.chance_of_infection[agents]/100 * self.increase_age_risk[agents] * self.increase_genetic_risk[agents] * self.increase_lifestyle_risk[agents]
+
+    def _risk(self, rng, proportion):
+        return np.where(rng.random(self.model.num_nodes) < proportion/100, 1.2, 1.0)
+
+    def states(self):
+        return np.where(self.wealth == 1, INFECTED, np.where(self.recovered == 1, RECOVERED, SUSCEPTIBLE)).astype(np.uint8)
+
+    def move(self):
+        #Every agent jumps to a uniformly chosen node within the model's move radius of its node, if there is one (see NeighborhoodIndex)
+        destination = self.neighborhood.sample(self.pos, self.rng)
+        movers = destination >= 0
+        self.pos[movers] = destination[movers]
+
+    def give_disease(self, infectious):
+        #Agents sorted by node, so the agents on node v are order[start[v]:start[v] + counts[v]]
+        order = np.argsort(self.pos, kind='stable')
+        counts = np.bincount(self.pos, minlength=self.model.num_nodes)
+        start = np.cumsum(counts) - counts
+        self.infect(self.transmit(np.flatnonzero(infectious), order, start, counts))
+
+    def transmit(self, sources, order, start, counts):
+        #The agents that the infectors `sources` (sorted) infect this step, given where every agent is (see give_disease). Nothing is changed yet.
+        #Every (infector, neighbouring node) pair, then every (infector, agent on that node) pair, grouped by infector
+        nodes = self.pos[sources]
+        degree = self.indptr[nodes + 1] - self.indptr[nodes]
+        pair_source = np.repeat(sources, degree)
+        pair_node = self.indices[expand_ranges(self.indptr[nodes], degree)]
+        pair_source = np.repeat(pair_source, counts[pair_node])
+        pair_target = order[expand_ranges(start[pair_node], counts[pair_node])]
+
+        susceptible = (self.wealth[pair_target] == 0) & (self.num_recoveries[pair_target] < self.model.num_recoveries_for_immune)
+        pair_source = pair_source[susceptible]
+        pair_target = pair_target[susceptible]
+
+        t = pair_target
+        success = (self.rng.random(len(t)) < self.susceptibility[t]) & (self.rng.random(len(t)) > self.vaccinated[t])
+
+        #Each infector stops at its first successful contact; a target reached by several infectors is only infected once
+        hits = np.flatnonzero(success)
+        _, first = np.unique(pair_source[hits], return_index=True)
+        return np.unique(pair_target[hits[first]])
+
+    def infect(self, new_cases):
+        self.model.counters.discard_many(self, new_cases)
+        self.recovered[new_cases] = 0
+        self.wealth[new_cases] = 1
+        self.model.counters.add_many(self, new_cases)
+        self.model.new_cases += len(new_cases)
+
+    def recover(self, agents=None):
+        #Recovers the infected agents that have been infected for num_steps steps, among `agents` (an index array) or the whole population
+        model = self.model
+        done = np.flatnonzero(self.steps == model.num_steps) if agents is None else agents[self.steps[agents] == model.num_steps]
+        model.counters.discard_many(self, done)
+        self.steps[done] = 0
+        self.wealth[done] = 0
+        self.recovered[done] = 1
+        self.num_recoveries[done] += 1
+
+        age = self.increase_age_risk[done]
+        self.chance_of_infection[done] = np.where(age == 1.2, self.chance_of_infection[done] * 0.75, self.chance_of_infection[done])
+        age = np.where(age == 1, age * 0.5, age)
+        self.increase_age_risk[done] = age
+        self.update_susceptibility(done)
+
+        #Vaccination code, with the same age-based effectiveness as NetworkAgent.step
+        vaccinate = self.rng.random(len(done)) <= model.vaccination_rate/100
+        effectiveness = np.where(age == 1.2, 0.35*model.vaccination_efficacy, np.where(age == 1, 0.80*model.vaccination_efficacy, self.vaccinated[done]))
+        self.vaccinated[done] = np.where(vaccinate, effectiveness, self.vaccinated[done])
+        model.vaccinations += int(vaccinate.sum())
+        model.counters.add_many(self, done)
+
+    def step(self):
+        #The phases of NetworkAgent.step, each done for the whole population at once (see the class comment) and timed once when the model is profiled
+        profiler = self.model.profiler
+        with profiler.phase("move"):
+            self.move()
+        infectious = self.wealth == 1
+        if infectious.any():
+            with profiler.phase("give_disease"):
+                self.give_disease(infectious)
+        self.steps = np.where(infectious, self.steps + 1, 0)
+        with profiler.phase("recovery"):
+            self.recover()
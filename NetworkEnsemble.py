@@ -0,0 +1,81 @@
+import contextlib
+import itertools
+import multiprocessing
+import os
+
+import numpy as np
+import pandas as pd
+
+from NetworkModel import NetworkModel
+from ResultsSink import ParquetSink
+
+
+def expand_grid(parameters):
+    #Every combination of the NetworkModel keyword arguments in `parameters`. A list (or tuple) of values is swept over, anything else is held fixed.
+    names = list(parameters)
+    values = [v if isinstance(v, (list, tuple)) else [v] for v in parameters.values()]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+def run_replicate(task):
+    #Runs in the worker process. Only the configuration is sent over, the model is built here.
+    config_index, config, replicate, num_ticks, seed, output_dir = task
+    if output_dir is None:
+        model = NetworkModel(**config, horizon=num_ticks, seed=seed)
+    else:
+        #Streamed to its own partition directory; only the path goes back to the parent
+        path = os.path.join(output_dir, f"config={config_index}", f"replicate={replicate}")
+        model = NetworkModel(**config, horizon=num_ticks, seed=seed, results_sink=ParquetSink(path, index="Step"))
+    model.create_agents()
+    for i in range(num_ticks):
+        model.step()
+    if output_dir is not None:
+        model.flush_results()
+        return config_index, replicate, path
+    return config_index, replicate, {name: model.results.column(name) for name in model.results.data}
+
+def run_ensemble(parameters, replicates, num_ticks, processes=None, chunksize=None, on_result=None, seed=None, output_dir=None):
+    #Runs `replicates` runs of every parameter combination over a process pool, and returns a tidy DataFrame with one row per (combination, replicate, step).
+    #on_result(config, replicate, results) is called in this process as each run comes back, in completion order.
+    #With an output_dir, each run streams its results to <output_dir>/config=<i>/replicate=<k>/ as Parquet chunks instead, and on_result gets that path.
+    #The combinations are then returned (and saved as _configs.parquet); read the runs back with ResultsSink.read_results(output_dir, columns=[...]).
+    #Replicate k of every combination is seeded with [*seed, k], wherever and whenever it runs. Runs can therefore be cached and replayed, and combinations compared under common random numbers.
+    #`seed` is an int or a sequence of ints; a sequence's entropy is a list, which is flattened into the replicate's seed.
+    seed = np.random.SeedSequence(seed).entropy
+    entropy = [int(value) for value in np.atleast_1d(seed)]
+    configs = expand_grid(parameters)
+    tasks = [(i, config, replicate, num_ticks, [*entropy, replicate], output_dir) for i, config in enumerate(configs) for replicate in range(replicates)]
+    processes = processes or os.cpu_count()
+    if chunksize is None:
+        #A few chunks per worker keeps the pool balanced without paying the IPC cost of one task at a time
+        chunksize = max(1, len(tasks) // (processes * 4))
+
+    runs = []
+    with (multiprocessing.Pool(processes) if processes > 1 else contextlib.nullcontext()) as pool:
+        finished = pool.imap_unordered(run_replicate, tasks, chunksize=chunksize) if pool else map(run_replicate, tasks)
+        for config_index, replicate, results in finished:
+            if output_dir is None:
+                runs.append((config_index, replicate, results))
+            if on_result is not None:
+                on_result(configs[config_index], replicate, results)
+
+    if output_dir is not None:
+        frame = pd.DataFrame(configs).rename_axis("config").reset_index().infer_objects()
+        frame.to_parquet(os.path.join(output_dir, "_configs.parquet"), index=False)
+    else:
+        frame = ensemble_frame(configs, runs)
+    frame.attrs["seed"] = seed
+    return frame
+
+def ensemble_frame(configs, runs):
+    runs = sorted(runs, key=lambda run: (run[0], run[1]))
+    lengths = np.array([len(results["Prevalence"]) for _, _, results in runs], dtype=np.int64)
+    config_index = np.repeat(np.array([run[0] for run in runs], dtype=np.int64), lengths)
+
+    columns = {}
+    for name in configs[0]:
+        columns[name] = np.array([config[name] for config in configs], dtype=object)[config_index]
+    columns["Replicate"] = np.repeat(np.array([run[1] for run in runs], dtype=np.int64), lengths)
+    columns["Step"] = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    for name in (runs[0][2] if runs else []):
+        columns[name] = np.concatenate([results[name] for _, _, results in runs])
+    return pd.DataFrame(columns).infer_objects()
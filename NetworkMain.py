@@ -1,4 +1,5 @@
 from NetworkModel import NetworkModel
+from DeltaNetworkModule import DeltaNetworkModule
 import mesa.visualization
 from mesa.visualization import StaticText
 
@@ -82,7 +83,13 @@ vaccination_efficacy_description = mesa.visualization.StaticText('<div style = "
 
 citation_text = mesa.visualization.StaticText('<div style = "width: 1000 px;" <p><a href = "https://pubmed.ncbi.nlm.nih.gov/11130187/">1. Impact of age-related immune dysfunction on risk of infections </a></p> <p><a href = "https://www.sciencedirect.com/science/article/pii/S128645791000211X?via%3Dihub">2. Impact of aging on viral infections </a></p> <p><a href = "https://www.cdc.gov/globalhealth/healthprotection/fieldupdates/winter-2017/ncds-impact-ghs.html">3. Three Ways NCDs Impact Global Health Security </a></p> <p><a href = "https://medcraveonline.com/JCCR/lifestyle-diseases-consequences-characteristics-causes-and-control.html"> 4. Lifestyle Disease Consequences: Causes and Characteristics</a></p>')
 
-grid = mesa.visualization.NetworkModule(network_portrayal, canvas_height=1000, canvas_width=864)
+#The delta view sends the graph once and then only the nodes that changed colour, with at most max_edges edges drawn. network_portrayal re-sends every node and edge each tick.
+delta_portrayal = True
+if delta_portrayal:
+    grid = DeltaNetworkModule(canvas_height=1000, canvas_width=864, max_edges=5000)
+else:
+    grid = mesa.visualization.NetworkModule(network_portrayal, canvas_height=1000, canvas_width=864)
+#ChartModule only sends the latest DataCollector values each tick and the browser appends them, so the charts already stream deltas
 chart4 = mesa.visualization.ChartModule([{'Label': 'Total Infections', 'Color': 'Red'}], data_collector_name="datacollector")
 chart = mesa.visualization.ChartModule([{'Label': 'Prevalence', 'Color': 'Black'}], data_collector_name="datacollector")
 chart2 = mesa.visualization.ChartModule([{'Label': 'Incidence', 'Color': 'Blue'}], data_collector_name="datacollector")
@@ -1,52 +1,97 @@
 import mesa
-import seaborn as sns
 import numpy as np
 import pandas as pd
 import random
-import matplotlib.pyplot as plt
-import matplotlib
 import networkx as nx
 import datetime
 import os
+import heapq
 
 import inspect
-
-matplotlib.use('Agg')
+import multiprocessing
+
+from NetworkArrayEngine import NetworkArrayEngine, graph_to_csr, csr_to_graph
+from PartitionedEngine import PartitionedEngine
+from EpidemicCounters import EpidemicCounters
+from GraphGenerators import generate_csr
+from MeanField import mean_field
+from NeighborhoodIndex import NeighborhoodIndex
+from Checkpoint import save_checkpoint, load_checkpoint, random_state, set_random_state, buffer_arrays, restore_buffer, recorder_arrays, restore_recorder, StoredGraph
+from ResultsBuffer import ResultsBuffer
+from RollingResults import RollingResults, trim_model_vars
+from PhaseProfiler import PhaseProfiler, NullProfiler
+from AgentStateRecorder import AgentStateRecorder, SUSCEPTIBLE, INFECTED, RECOVERED
 
 #https://pubmed.ncbi.nlm.nih.gov/11130187/
 #https://www.sciencedirect.com/science/article/pii/S128645791000211X?via%3Dihub
 
-output_path = "C:/Users/sweek/Documents/buildspace/output_data"
-
+#The reporters read the running counts in model.counters (see EpidemicCounters), which agents update on every state transition, instead of scanning the population
 def compute_total_infections(model):
-    return sum(1 for agent in model.agents if agent.wealth == 1 and agent.recovered == 0)
+    return model.counters.infected
 
 def compute_prevalence(model):
-    return sum(1 for agent in model.agents if agent.wealth == 1 and agent.recovered == 0)/model.num_nodes
+    return model.counters.infected/model.num_nodes
 def compute_incidence(model):
     return model.new_cases / model.num_nodes
 def compute_recovered(model):
-    return sum(1 for agent in model.agents if agent.recovered == 1)
+    return model.counters.recovered
 def compute_infected(model):
-    return sum(1 for agent in model.agents if agent.wealth == 1 and agent.recovered == 0)
+    return model.counters.infected
 def compute_susceptible(model):
-    return sum(1 for agent in model.agents if agent.wealth == 0 and agent.num_recoveries < model.num_recoveries_for_immune)
+    return model.counters.susceptible
 def compute_vaccinated(model):
     return model.vaccinations
 def compute_prevalence_age(model):
-    return sum(1 for agent in model.agents if agent.wealth == 1 and agent.recovered == 0 and agent.increase_age_risk != 1)/sum(1 for agent in model.agents if agent.increase_age_risk != 1)
+    return model.counters.prevalence("increase_age_risk")
 def compute_prevalence_genetic(model):
-    return sum(1 for agent in model.agents if agent.wealth == 1 and agent.recovered == 0 and agent.increase_genetic_risk != 1)/sum(1 for agent in model.agents if agent.increase_genetic_risk != 1)
+    return model.counters.prevalence("increase_genetic_risk")
 def compute_prevalence_lifestyle(model):
-    return sum(1 for agent in model.agents if agent.wealth == 1 and agent.recovered == 0 and agent.increase_lifestyle_risk != 1)/sum(1 for agent in model.agents if agent.increase_lifestyle_risk != 1)
+    return model.counters.prevalence("increase_lifestyle_risk")
 def compute_prevalence_tobacco(model):
-    return sum(1 for agent in model.agents if agent.wealth == 1 and agent.recovered == 0 and agent.increase_tobacco_use != 1)/sum(1 for agent in model.agents if agent.increase_tobacco_use != 1)
+    return model.counters.prevalence("increase_tobacco_use")
 def compute_prevalence_diet(model):
-    return sum(1 for agent in model.agents if agent.wealth == 1 and agent.recovered == 0 and agent.increase_unhealthy_diet != 1)/sum(1 for agent in model.agents if agent.increase_unhealthy_diet != 1)
+    return model.counters.prevalence("increase_unhealthy_diet")
 def compute_prevalence_activity(model):
-    return sum(1 for agent in model.agents if agent.wealth == 1 and agent.recovered == 0 and agent.increase_physical_activity != 1)/sum(1 for agent in model.agents if agent.increase_physical_activity != 1)
+    return model.counters.prevalence("increase_physical_activity")
 def compute_prevalence_alcohol(model):
-    return sum(1 for agent in model.agents if agent.wealth == 1 and agent.recovered == 0 and agent.increase_alcohol_use != 1)/sum(1 for agent in model.agents if agent.increase_alcohol_use != 1)
+    return model.counters.prevalence("increase_alcohol_use")
+
+def agent_state(agent):
+    if agent.wealth == 1:
+        return INFECTED
+    if agent.recovered == 1:
+        return RECOVERED
+    return SUSCEPTIBLE
+
+
+#The per-agent state that a checkpoint holds, named as in NetworkAgent and NetworkArrayEngine
+agent_attributes = ("wealth", "steps", "recovered", "num_recoveries", "chance_of_infection", "vaccinated", "increase_age_risk", "increase_genetic_risk",
+                    "increase_tobacco_use", "increase_unhealthy_diet", "increase_physical_activity", "increase_alcohol_use", "increase_lifestyle_risk")
+#Model attributes that a checkpoint holds besides the agents
+model_scalars = ("steps", "running", "vaccinations", "new_cases", "new_recoveries", "total_infections", "prevalence", "incidence", "susceptible", "infected", "recovered",
+                 "prevalence_age_risk", "prevalence_genetic_risk", "prevalence_tobacco_risk", "prevalence_diet_risk", "prevalence_physical_activity_risk",
+                 "prevalence_alcohol_risk", "prevalence_lifestyle_risk")
+#These only shape the graph and the agents' initial risk factors, which a restored model takes from the checkpoint, so they cannot be overridden
+fixed_parameters = ("N", "graph_type", "m_value", "p_value", "age_risk_proportion", "genetic_risk_proportion", "tobacco_risk_proportion", "unhealthy_diet_proportion",
+                    "physical_activity_proportion", "alcohol_use_proportion", "income_multiplier")
+#Objects that are not saved; pass them again to from_checkpoint if the restored model needs them
+runtime_parameters = ("graph_cache", "results_sink", "transitions_sink", "aggregates")
+
+
+def generate_graph(graph_type, N, m_value, p_value, seed=None):
+    if graph_type == 'Barabasi Albert':
+        #In a Barabasi Albert graph, the m value is the number of new edges per new node. Therefore, when a new node is added to the network, it establishes m edges to existing nodes. Nodes with more connections are more likely to receive new edges. A larger m value will increase the connectivity of new nodes, leading to a network with a high number of edges and more pronounced hubs.
+        return nx.barabasi_albert_graph(n=N, m=m_value, seed=seed)
+    elif graph_type == 'Watts Strogatz':
+        #In a Watts Strogatz graph, the p_value represents the probability of rewiring each edge, or the randomness of the graph. It controls the tradeoff between a regular lattice (p = 0), and a completely random graph (p = 1)
+        return nx.watts_strogatz_graph(n=N, k=6, p=p_value/10, seed=seed)
+    elif graph_type == 'Erdos Renyi':
+        #In an Erdos-Renyi graph, the p_value represents the probability that an edge exists between any pair of nodes. This probability controls the density of the network, with a p = 0 creating a graph with n isolated nodes and no edges, while a p = 1 creates a complete graph where everyr possible edge between nodes exists.
+        return nx.erdos_renyi_graph(n=N, p=p_value/10, seed=seed)
+    elif graph_type == 'Power Law Cluster':
+        #In a Power-Law Cluster Graph, m is the number of new edges per node (the same as a Barabasi Albert graph). Meanwhile, p is the probability of adding a triangle, or when a new edge is added to the network, a triangle forming by adding an additional edge between two existing nodes that are both connected to the new node. A higher p value means higher clustering.
+        return nx.powerlaw_cluster_graph(n=N, m=m_value, p=p_value/10, seed=seed)
+    raise ValueError(f"Unknown graph type {graph_type!r}")
 
 
 class NetworkAgent(mesa.Agent):
@@ -74,24 +119,29 @@ class NetworkAgent(mesa.Agent):
             self.wealth = 1
         if self.unique_id < self.model.vaccination_rate * self.model.num_nodes:
             self.vaccinated = self.model.vaccination_efficacy
-        if random.random() < self.model.age_risk_proportion/100:
+        if self.model.agent_random.random() < self.model.age_risk_proportion/100:
             self.increase_age_risk = 1.2
-        if random.random() < self.model.genetic_risk_proportion/100:
+        if self.model.agent_random.random() < self.model.genetic_risk_proportion/100:
             self.increase_genetic_risk = 1.2
-        if random.random() < self.model.tobacco_risk_proportion/100:
+        if self.model.agent_random.random() < self.model.tobacco_risk_proportion/100:
             self.increase_tobacco_use = 1.2
-        if random.random() < self.model.unhealthy_diet_proportion/100:
+        if self.model.agent_random.random() < self.model.unhealthy_diet_proportion/100:
             self.increase_unhealthy_diet = 1.2
-        if random.random() < self.model.physical_activity_proportion/100:
+        if self.model.agent_random.random() < self.model.physical_activity_proportion/100:
             self.increase_physical_activity = 1.2
-        if random.random() < self.model.alcohol_use_proportion/100:
+        if self.model.agent_random.random() < self.model.alcohol_use_proportion/100:
             self.increase_alcohol_use = 1.2
             self.increase_lifestyle_risk = self.increase_tobacco_use * self.increase_unhealthy_diet * self.increase_physical_activity * self.increase_alcohol_use * self.model.income_multiplier
+        self.update_susceptibility()
+
+    def update_susceptibility(self):
+        #The chance of infection per contact, kept so give_disease does not multiply the risk factors out for every contact. Whatever changes chance_of_infection or one of the multipliers calls this afterwards.
+        self.susceptibility = self.chance_of_infection/100 * self.increase_age_risk * self.increase_genetic_risk * self.increase_lifestyle_risk
 
     def move(self):
-        possible_steps = self.model.grid.get_neighborhood(self.pos, include_center=False, radius=2)
-        if len(possible_steps) > 0:
-            new_position = self.random.choice(possible_steps)
+        #A uniformly random node within move_radius, as self.random.choice(self.model.grid.get_neighborhood(self.pos, include_center=False, radius=self.model.move_radius)), from the model's precomputed index (see NeighborhoodIndex.choice for when the draw is the same too)
+        new_position = self.model.neighborhood.choice(self.pos, self.random)
+        if new_position is not None:
             self.model.grid.move_agent(self, new_position)
 
     def give_disease(self):
@@ -100,57 +150,124 @@ class NetworkAgent(mesa.Agent):
         if susceptible_neighbors:
             for a in susceptible_neighbors:
                 if a.wealth == 0 and a.num_recoveries < a.model.num_recoveries_for_immune:
-                    if a.random.random() < a.chance_of_infection/100 * a.increase_age_risk * a.increase_genetic_risk * a.increase_lifestyle_risk:
-                        if random.random() > a.vaccinated:
+                    if a.random.random() < a.susceptibility:
+                        if a.random.random() > a.vaccinated:
+                            self.model.begin_transition(a)
                             a.recovered = 0
                             a.wealth = 1
+                            self.model.end_transition(a)
                             self.model.new_cases += 1
                             break
 
     def step(self):
-        self.move()
+        with self.model.profiler.phase("move"):
+            self.move()
+        self.advance()
+
+    def advance(self):
+        #The rest of the step after moving: transmission, then counting the steps infected, then recovery and vaccination
         if self.wealth == 1:
-            self.give_disease()
+            with self.model.profiler.phase("give_disease"):
+                self.give_disease()
             self.steps += 1
         elif self.wealth == 0:
             self.steps = 0
         if self.steps == self.model.num_steps:
-            self.steps = 0
-            self.wealth = 0
-            self.recovered = 1
-            self.num_recoveries += 1
+            with self.model.profiler.phase("recovery"):
+                self.recover()
+
+    def recover(self):
+        self.model.begin_transition(self)
+        self.steps = 0
+        self.wealth = 0
+        self.recovered = 1
+        self.num_recoveries += 1
+        if self.increase_age_risk == 1.2:
+            self.chance_of_infection *= 0.75
+        elif self.increase_age_risk == 1:
+            self.increase_age_risk *= 0.5
+        self.update_susceptibility()
+
+        #Vaccination code
+        #Efficacy of vaccines - 30-40% for ages 65+ and 70-90% for ages <65
+        if self.random.random() <= self.model.vaccination_rate/100:
+            #Age factors
             if self.increase_age_risk == 1.2:
-                self.chance_of_infection *= 0.75
+                self.vaccinated = 0.35*self.model.vaccination_efficacy
             elif self.increase_age_risk == 1:
-                self.increase_age_risk *= 0.5
-
-            #Vaccination code
-            #Efficacy of vaccines - 30-40% for ages 65+ and 70-90% for ages <65
-            if random.random() <= self.model.vaccination_rate/100:
-                #Age factors
-                if self.increase_age_risk == 1.2:
-                    self.vaccinated = 0.35*self.model.vaccination_efficacy
-                elif self.increase_age_risk == 1:
-                    self.vaccinated = 0.80*self.model.vaccination_efficacy
-                self.model.vaccinations += 1
+                self.vaccinated = 0.80*self.model.vaccination_efficacy
+            self.model.vaccinations += 1
+        self.model.end_transition(self)
 
 
 class NetworkModel(mesa.Model):
     """A model with some number of agents."""
 
-    def __init__(self, N, chance_of_infection, graph_type, m_value, p_value, num_recoveries_for_immune, num_steps,  age_risk_proportion, genetic_risk_proportion, tobacco_risk_proportion, unhealthy_diet_proportion, physical_activity_proportion, alcohol_use_proportion, income_multiplier, vaccination_rate, vaccination_efficacy):
-
-        super().__init__()
+    def __init__(self, N, chance_of_infection, graph_type, m_value, p_value, num_recoveries_for_immune, num_steps,  age_risk_proportion, genetic_risk_proportion, tobacco_risk_proportion, unhealthy_diet_proportion, physical_activity_proportion, alcohol_use_proportion, income_multiplier, vaccination_rate, vaccination_efficacy, engine='agents', horizon=None, seed=None, graph_cache=None, scheduler='all', results_sink=None, transitions_sink=None, flush_every=1000, profile=False, stop_on_extinction=False, graph_backend='networkx', move_radius=2, neighborhood_max_bytes=2**30, partitions=None, partitioner='auto', retention_window=None, decimate_every=1, retention_history=None, aggregates=None):
+        #The keyword arguments, saved with checkpoints (see save_checkpoint)
+        parameters = {name: value for name, value in locals().items() if name not in ('self', '__class__') + runtime_parameters}
+
+        #One seed (an int, a sequence of ints, or None for fresh entropy) is split into independent streams for the contact graph, the agents' initial risk factors, and the dynamics (movement, transmission, vaccination), so adding draws to one of them never shifts the others
+        seed_sequence = np.random.SeedSequence(seed)
+        graph_seed, agent_seed, dynamics_seed = seed_sequence.spawn(3)
+        super().__init__(seed=int(dynamics_seed.generate_state(1, np.uint64)[0]))
+
+        #The entropy recorded here replays the run exactly, also when no seed was given
+        self.seed = seed_sequence.entropy
+        self.parameters = {**parameters, "seed": self.seed}
+        self.agent_random = random.Random(int(agent_seed.generate_state(1, np.uint64)[0]))
+        graph_seed = int(graph_seed.generate_state(1, np.uint64)[0])
+        self.graph_seed = graph_seed
         
         self.num_nodes = N
         self.num_steps = num_steps
 
-        self.results_df = pd.DataFrame(columns=[
-            "Total Infections", "Prevalence", "Incidence", "Susceptible", "Infected", "Recovered", 
-            "Vaccinations", "Prevalence - Age Risk", "Prevalence - Genetic Risk", 
-            "Prevalence - Tobacco", "Prevalence - Diet", "Prevalence - Physical Activity", 
-            "Prevalence - Alcohol Use", "Prevalence - Lifestyle Risk"
-        ])
+        #'agents' runs one NetworkAgent per node through the NetworkGrid, one agent after another. 'array' keeps the same agent state in NumPy arrays and steps the whole population at once (see NetworkArrayEngine), for large N.
+        #'partitioned' splits the graph into `partitions` parts (by default one per CPU) with the partitioner ('auto', 'bfs' or 'metis', see GraphPartition) and steps the array engine's agents on each part in its own process (see PartitionedEngine), for a single run too large for one core.
+        #'array' and 'partitioned' are not interchangeable with 'agents': updating everyone at once is a synchronous version of the model, whose epidemics peak later and lower, so only compare results between runs of the same engine.
+        if engine not in ('agents', 'array', 'partitioned'):
+            raise ValueError(f"Unknown engine {engine!r}, expected 'agents', 'array' or 'partitioned'")
+        if engine == 'partitioned' and 'fork' not in multiprocessing.get_all_start_methods():
+            raise ValueError("The partitioned engine needs the 'fork' start method, which this platform does not have")
+        self.engine_type = engine
+        self.engine = None
+        self.partitions = partitions
+        self.partitioner = partitioner
+
+        #'all' activates every agent each tick. 'frontier' only activates the infected agents, the only ones with transmission, recovery or vaccination pending; everyone else only moves, and they all move at once (see frontier_step).
+        #Its runs differ from 'all' in the order of events and draws within a tick, not in the rules.
+        if scheduler not in ('all', 'frontier'):
+            raise ValueError(f"Unknown scheduler {scheduler!r}, expected 'all' or 'frontier'")
+        if scheduler == 'frontier' and (engine != 'agents' or num_steps < 1):
+            #With num_steps == 0 every agent recovers every tick, so there is no frontier to keep
+            raise ValueError("The frontier scheduler needs engine='agents' and num_steps >= 1")
+        self.scheduler = scheduler
+        #For 'frontier': the indices (unique_id - 1) of the infected agents, and every agent's node, set up at its first step
+        self.frontier = None
+        self.positions = None
+        #The agents still to be activated this tick, as a heap of indices, and the index of the one being activated
+        self.queue = []
+        self.activating = N
+
+        #One row per step, stored column by column. If the number of steps (horizon) is known up front the columns are allocated once at that size.
+        columns = {
+            "Total Infections": np.int64, "Prevalence": np.float64, "Incidence": np.float64, "Susceptible": np.int64, "Infected": np.int64, "Recovered": np.int64,
+            "Vaccinations": np.int64, "Prevalence - Age Risk": np.float64, "Prevalence - Genetic Risk": np.float64,
+            "Prevalence - Tobacco": np.float64, "Prevalence - Diet": np.float64, "Prevalence - Physical Activity": np.float64,
+            "Prevalence - Alcohol Use": np.float64, "Prevalence - Lifestyle Risk": np.float64
+        }
+        #With a retention_window, only the last retention_window rows are kept in full, with a thinned sample of the older ones (every decimate_every-th, at most retention_history rows) and the aggregates over all of them (see RollingResults and results_summary).
+        #The DataCollector is kept to the window too, so memory stays bounded however many steps the run takes.
+        self.retention_window = retention_window
+        if retention_window is not None:
+            if results_sink is not None:
+                raise ValueError("Pass either a results_sink or a retention_window, not both")
+            self.results = RollingResults(columns, retention_window, decimate_every=decimate_every, history=retention_history, aggregates=aggregates)
+        else:
+            self.results = ResultsBuffer(columns, capacity=horizon or 256, sink=results_sink, flush_every=flush_every)
+        #With sinks (see ResultsSink.ParquetSink) the results, and the agent-state transitions, are written out every flush_every rows while the run is going. Call flush_results() at the end to write the rest.
+        self.transitions_sink = transitions_sink
+        self.flush_every = flush_every
 
         #Defines the number of recoveries that are required for a person to become IMMUNE from a disease. This is to reflect the evolution of diseases, and different strains that may arise.
         self.num_recoveries_for_immune = num_recoveries_for_immune
@@ -176,23 +293,37 @@ class NetworkModel(mesa.Model):
         self.vaccinations = 0
 
         #Here, need to generate a random graph, and then make a grid on it
-        if graph_type == 'Barabasi Albert':
-            #In a Barabasi Albert graph, the m value is the number of new edges per new node. Therefore, when a new node is added to the network, it establishes m edges to existing nodes. Nodes with more connections are more likely to receive new edges. A larger m value will increase the connectivity of new nodes, leading to a network with a high number of edges and more pronounced hubs.
-            self.G = nx.barabasi_albert_graph(n=self.num_nodes, m=m_value)
-        elif graph_type == 'Watts Strogatz':
-            #In a Watts Strogatz graph, the p_value represents the probability of rewiring each edge, or the randomness of the graph. It controls the tradeoff between a regular lattice (p = 0), and a completely random graph (p = 1)
-            self.G= nx.watts_strogatz_graph(n=self.num_nodes, k=6, p=p_value/10)
-        elif graph_type == 'Erdos Renyi':
-            #In an Erdos-Renyi graph, the p_value represents the probability that an edge exists between any pair of nodes. This probability controls the density of the network, with a p = 0 creating a graph with n isolated nodes and no edges, while a p = 1 creates a complete graph where everyr possible edge between nodes exists.
-            self.G = nx.erdos_renyi_graph(n=self.num_nodes, p=p_value/10)
-        elif graph_type == 'Power Law Cluster':
-            #In a Power-Law Cluster Graph, m is the number of new edges per node (the same as a Barabasi Albert graph). Meanwhile, p is the probability of adding a triangle, or when a new edge is added to the network, a triangle forming by adding an additional edge between two existing nodes that are both connected to the new node. A higher p value means higher clustering.
-            self.G = nx.powerlaw_cluster_graph(n=self.num_nodes, m=m_value, p=p_value/10)
-        self.grid = mesa.space.NetworkGrid(self.G)
+        #'networkx' generates it with networkx. 'native' builds its CSR arrays directly (see GraphGenerators), which is much faster for large N; the array engine then never needs a networkx graph.
+        if graph_backend not in ('networkx', 'native'):
+            raise ValueError(f"Unknown graph backend {graph_backend!r}, expected 'networkx' or 'native'")
+        self.graph_backend = graph_backend
+        if graph_backend == 'native':
+            build = lambda: generate_csr(graph_type, self.num_nodes, m_value, p_value, graph_seed)
+        else:
+            build = lambda: graph_to_csr(generate_graph(graph_type, self.num_nodes, m_value, p_value, graph_seed))
+
+        #Agents move to a random node within move_radius hops each step. The neighborhoods are indexed once for the whole run (see NeighborhoodIndex), in at most neighborhood_max_bytes (None for no limit); it is built when first needed.
+        self.move_radius = move_radius
+        self.neighborhood_max_bytes = neighborhood_max_bytes
+        self._neighborhood = None
+
+        #With a graph_cache (see GraphCache) and a fixed seed, the graph is generated once and later models memory-map its CSR arrays instead. The networkx graph and the grid are then only built when something asks for them.
+        self._G = None
+        self._grid = None
+        self.adjacency = None
+        if graph_cache is not None and seed is not None:
+            #The graph is always rebuilt from the stored arrays, even right after generating it, so a run gives the same output whether or not the cache already had its graph
+            self.adjacency = graph_cache.get_or_create(graph_type, self.num_nodes, m_value, p_value, graph_seed, build, backend=graph_backend)
+        elif graph_backend == 'native':
+            self.adjacency = build()
+        else:
+            self._G = generate_graph(graph_type, self.num_nodes, m_value, p_value, graph_seed)
 
         self.new_cases = 0
         self.new_recoveries = 0
 
+        self.counters = EpidemicCounters(self.num_recoveries_for_immune)
+
         self.datacollector = mesa.DataCollector(model_reporters={
          "Total Infections": compute_total_infections,
          "Prevalence": compute_prevalence,
@@ -207,8 +338,16 @@ class NetworkModel(mesa.Model):
          "Prevalence - Diet": compute_prevalence_diet,
          "Prevalence - Physical Activity": compute_prevalence_activity,
          "Prevalence - Alcohol Use": compute_prevalence_alcohol,
-         "Prevalence - Lifestyle Risk": compute_prevalence_lifestyle},
-        agent_reporters={"Wealth": "wealth"})
+         "Prevalence - Lifestyle Risk": compute_prevalence_lifestyle})
+
+        #With profile=True, the wall time and call count of each phase of step() are recorded per step (see PhaseProfiler and profile_df). Otherwise the phases go to a NullProfiler, which does nothing with them.
+        self.profiler = PhaseProfiler() if profile else NullProfiler()
+
+        #Nothing brings infection back into the population, so once nobody is infected no further event can happen. With stop_on_extinction the model then sets running to False.
+        self.stop_on_extinction = stop_on_extinction
+
+        #Per-agent states are kept as a log of transitions (see AgentStateRecorder) rather than one DataCollector record per agent per step. It is created with the agents.
+        self.state_recorder = None
 
         self.total_infections = 1
         self.vaccinations = 0
@@ -228,29 +367,166 @@ class NetworkModel(mesa.Model):
         self.prevalence_alcohol_risk = 0
         self.prevalence_lifestyle_risk = 0
 
+    @property
+    def G(self):
+        if self._G is None:
+            self._G = csr_to_graph(*self.adjacency)
+        return self._G
+
+    @property
+    def grid(self):
+        if self._grid is None:
+            self._grid = mesa.space.NetworkGrid(self.G)
+        return self._grid
+
+    @property
+    def neighborhood(self):
+        if self._neighborhood is None:
+            indptr, indices = self.adjacency if self.adjacency is not None else graph_to_csr(self.G)
+            self._neighborhood = NeighborhoodIndex(indptr, indices, radius=self.move_radius, max_bytes=self.neighborhood_max_bytes)
+        return self._neighborhood
+
+    @property
+    def results_df(self):
+        return self.results.to_frame()
+
+    @property
+    def results_summary(self):
+        #The aggregates over every step, e.g. the mean, variance and peak of the prevalence; only with a retention_window
+        return self.results.summary() if self.retention_window is not None else {}
+
+    @property
+    def profile_df(self):
+        #One row per step with the seconds and calls of every phase; only with profile=True
+        return self.profiler.to_frame()
+
+    def mean_field(self, num_ticks):
+        #Fast approximation of num_ticks steps of this model from its graph and parameters alone, shaped like results_df (see MeanField). No agents are needed.
+        return mean_field(self, num_ticks)
+
+    def save_checkpoint(self, path):
+        #Saves everything needed to continue this run (see Checkpoint): the graph, every agent's state and position, the counters, the random number generator states, the results and the agent-state log
+        meta = {"parameters": self.parameters, "scalars": {name: getattr(self, name) for name in model_scalars}, "agents": self.state_recorder is not None,
+                "random": random_state(self.random), "rng": self.rng.bit_generator.state, "agent_random": random_state(self.agent_random)}
+        arrays = buffer_arrays("results", self.results)
+        #A generated graph is only referenced through the saved seed, and generated again on restore: rebuilt from CSR arrays its neighbours would come out in another order, which changes who an infector reaches first
+        if self.adjacency is not None:
+            arrays["indptr"], arrays["indices"] = self.adjacency
+        if self.engine is not None:
+            arrays.update({name: getattr(self.engine, name) for name in agent_attributes})
+            arrays["pos"] = self.engine.pos
+        elif self.state_recorder is not None:
+            agents = list(self.agents)
+            arrays.update({name: np.array([getattr(a, name) for a in agents]) for name in agent_attributes})
+            arrays["pos"] = self.agent_positions()
+            #get_neighbors lists a node's agents in the order they arrived there, which decides who an infector reaches first, so that order is kept too
+            arrays["grid_order"] = np.fromiter((a.unique_id - 1 for node in range(self.num_nodes) for a in self.grid.get_cell_list_contents([node])), dtype=np.int64, count=len(agents))
+        if self.state_recorder is not None:
+            meta["recorder_steps"] = self.state_recorder.steps
+            arrays.update(recorder_arrays(self.state_recorder))
+        save_checkpoint(path, meta, arrays)
+
+    @classmethod
+    def from_checkpoint(cls, path, **overrides):
+        #A model that continues from the checkpoint at `path` exactly as the saved one would have, e.g. to resume a preempted run.
+        #Keyword arguments override the saved parameters, so one outbreak prefix can be forked into branches with other vaccination rates, efficacies, chances of infection and so on.
+        #A seed override gives the branch fresh random streams (see reseed) instead of the saved ones. The risk proportions and the graph cannot be overridden (see fixed_parameters).
+        fixed = [name for name in overrides if name in fixed_parameters]
+        if fixed:
+            raise ValueError(f"Cannot override {', '.join(fixed)} when restoring a checkpoint")
+        reseed = "seed" in overrides
+        seed = overrides.pop("seed", None)
+        meta, arrays = load_checkpoint(path)
+        graph_cache = StoredGraph(arrays["indptr"], arrays["indices"]) if "indptr" in arrays else None
+        model = cls(**{**meta["parameters"], **overrides}, graph_cache=graph_cache)
+        model._restore(meta, arrays)
+        if reseed:
+            model.reseed(seed)
+        return model
+
+    def reseed(self, seed):
+        #Replaces the random streams from here on with ones drawn from `seed` (None for fresh entropy). The graph and the agents' risk factors stay as they are, and the parameters keep the seed they came from.
+        agent_seed, dynamics_seed = [int(s.generate_state(1, np.uint64)[0]) for s in np.random.SeedSequence(seed).spawn(3)[1:]]
+        self.agent_random.seed(agent_seed)
+        self.random.seed(dynamics_seed)
+        #Set in place, since the array engine holds on to the same Generator
+        self.rng.bit_generator.state = np.random.default_rng(self.random.getrandbits(64)).bit_generator.state
+
+    def _restore(self, meta, arrays):
+        for name, value in meta["scalars"].items():
+            setattr(self, name, value)
+        restore_buffer(self.results, "results", arrays)
+        for name in self.results.data:
+            self.datacollector.model_vars[name] = arrays[f"results/{name}"][-(self.retention_window or 0):].tolist()
+
+        if meta["agents"]:
+            self.create_agents()
+            states = {name: arrays[name] for name in agent_attributes}
+            #An agent's chance of infection is the model's, reduced by a quarter per recovery for agents with age risk, so it follows an overridden chance_of_infection
+            if self.chance_of_infection != meta["parameters"]["chance_of_infection"]:
+                states["chance_of_infection"] = self.chance_of_infection * np.where(states["increase_age_risk"] == 1.2, 0.75**states["num_recoveries"], 1.0)
+            self.counters = EpidemicCounters(self.num_recoveries_for_immune)
+            if self.engine is not None:
+                #Written into the engine's arrays, which the partitioned engine keeps in shared memory
+                for name, values in states.items():
+                    getattr(self.engine, name)[:] = values
+                self.engine.update_susceptibility()
+                self.engine.pos[:] = arrays["pos"]
+                self.counters.add_many(self.engine, slice(None))
+            else:
+                agents = list(self.agents)
+                for name, values in states.items():
+                    for agent, value in zip(agents, values.tolist()):
+                        setattr(agent, name, value)
+                for agent in agents:
+                    agent.update_susceptibility()
+                for agent in agents:
+                    self.grid.remove_agent(agent)
+                for i in arrays["grid_order"] if "grid_order" in arrays else range(len(agents)):
+                    self.grid.place_agent(agents[i], int(arrays["pos"][i]))
+                for agent in agents:
+                    self.counters.add(agent)
+            self.state_recorder = restore_recorder(arrays, meta["recorder_steps"], sink=self.transitions_sink, flush_every=self.flush_every)
+
+        set_random_state(self.random, meta["random"])
+        self.rng.bit_generator.state = meta["rng"]
+        set_random_state(self.agent_random, meta["agent_random"])
+
     def create_agents(self):
+        if self.engine_type != 'agents':
+            self.engine = PartitionedEngine(self) if self.engine_type == 'partitioned' else NetworkArrayEngine(self)
+            self.counters.add_many(self.engine, slice(None))
+            self.state_recorder = AgentStateRecorder(self.engine.states(), sink=self.transitions_sink, flush_every=self.flush_every)
+            return
         for i, node in enumerate(self.G.nodes()):
             a = NetworkAgent(model=self)
             # Add the agent to a node
             self.grid.place_agent(a, node)
+            self.counters.add(a)
+        self.state_recorder = AgentStateRecorder([agent_state(a) for a in self.agents], sink=self.transitions_sink, flush_every=self.flush_every)
 
     def step(self):
-        self.datacollector.collect(self)
-
-        self.total_infections = compute_total_infections(self)
-        self.prevalence = compute_prevalence(self)
-        self.incidence = compute_incidence(self)
-        self.susceptible = compute_susceptible(self)
-        self.infected = compute_infected(self)
-        self.recovered = compute_recovered(self)
-        self.vaccinations = compute_vaccinated(self)
-        self.prevalence_age_risk = compute_prevalence_age(self)
-        self.prevalence_genetic_risk = compute_prevalence_genetic(self)
-        self.prevalence_tobacco_risk = compute_prevalence_tobacco(self)
-        self.prevalence_diet_risk = compute_prevalence_diet(self)
-        self.prevalence_physical_activity_risk = compute_prevalence_activity(self)
-        self.prevalence_alcohol_risk = compute_prevalence_alcohol(self)
-        self.prevalence_lifestyle_risk = compute_prevalence_lifestyle(self)
+        profiler = self.profiler
+        with profiler.phase("collect"):
+            self.datacollector.collect(self)
+            if self.retention_window is not None:
+                trim_model_vars(self.datacollector, self.retention_window)
+
+        with profiler.phase("reporters"):
+            self.total_infections = compute_total_infections(self)
+            self.prevalence = compute_prevalence(self)
+            self.incidence = compute_incidence(self)
+            self.susceptible = compute_susceptible(self)
+            self.infected = compute_infected(self)
+            self.recovered = compute_recovered(self)
+            self.vaccinations = compute_vaccinated(self)
+            self.prevalence_age_risk = compute_prevalence_age(self)
+            self.prevalence_genetic_risk = compute_prevalence_genetic(self)
+            self.prevalence_tobacco_risk = compute_prevalence_tobacco(self)
+            self.prevalence_diet_risk = compute_prevalence_diet(self)
+            self.prevalence_physical_activity_risk = compute_prevalence_activity(self)
+            self.prevalence_alcohol_risk = compute_prevalence_alcohol(self)
+            self.prevalence_lifestyle_risk = compute_prevalence_lifestyle(self)
 
         new_row = {
             "Total Infections": self.total_infections,
@@ -269,20 +545,90 @@ class NetworkModel(mesa.Model):
             "Prevalence - Lifestyle Risk": self.prevalence_lifestyle_risk,
         }
     
-        self.results_df = self.results_df._append(new_row, ignore_index=True)
+        with profiler.phase("results"):
+            self.results.append(new_row)
         self.new_cases = 0
-        self.agents.do("step")
-
-        # if self.agents.do("step") != 1 and prevalence == 0.0:
-        #     print("All agents have recovered. Simulation finished.")
-        #     self.running = False
-            # ct = str(datetime.datetime.now())
-            # ct = ct.replace(':', '-')
-            # ct = ct.replace(' ', '--')
-            # filename = f'{ct}_network_model_run.csv'
-            # filepath = os.path.join(output_path, filename)
-            # self.results_df.to_csv(filepath, index=False)
-            # print("Saved!")
+        with profiler.phase("agents"):
+            if self.engine is not None:
+                self.engine.step()
+            elif self.scheduler == 'frontier':
+                self.frontier_step()
+            else:
+                self.agents.do("step")
+        if self.engine is not None:
+            self.state_recorder.capture(self.steps, self.engine.states())
+        else:
+            self.state_recorder.finish_step(self.steps)
+        profiler.end_step(self.steps)
+        if self.stop_on_extinction and self.counters.infected == 0:
+            self.running = False
+
+    def agent_positions(self):
+        #The node each agent is on, indexed like the state recorder's arrays
+        if self.engine is not None:
+            return self.engine.pos
+        return np.fromiter((a.pos for a in self.agents), dtype=np.int64, count=len(self.agents))
+
+    def flush_results(self):
+        self.results.flush()
+        if self.state_recorder is not None:
+            self.state_recorder.log.flush()
+
+    #Every agent state change happens between these two calls, which keep the counters and the state recorder up to date
+    def begin_transition(self, agent):
+        self.counters.discard(agent)
+
+    def end_transition(self, agent):
+        self.counters.add(agent)
+        self.state_recorder.record(self.steps, agent.unique_id - 1, agent_state(agent))
+        if self.frontier is not None:
+            if agent.wealth == 1:
+                self.frontier.add(agent.unique_id - 1)
+                if agent.unique_id - 1 > self.activating:
+                    heapq.heappush(self.queue, agent.unique_id - 1)
+            else:
+                self.frontier.discard(agent.unique_id - 1)
+
+    def frontier_step(self):
+        #The agents outside the frontier move first, all at once, with one draw each from the model's Generator (as the array engine moves everyone); then the infected agents step in unique_id order, as agents.do("step") would.
+        #The grid is updated by rebuilding every node's list of agents, in unique_id order, so a tick costs a few array operations over the population and a Python step() per infected agent.
+        #An agent infected during the tick has already moved. If its turn is still to come it takes the rest of its step (see NetworkAgent.advance) then, like it would under agents.do("step"); otherwise at the next tick.
+        if self.frontier is None:
+            self.population = np.empty(len(self.agents), dtype=object)
+            self.population[:] = list(self.agents)
+            self.frontier = {i for i, agent in enumerate(self.population) if agent.wealth == 1}
+            self.positions = np.fromiter((agent.pos for agent in self.population), dtype=np.int64, count=len(self.population))
+            self.node_agents = [self.grid.G.nodes[node] for node in range(self.num_nodes)]
+        active = sorted(self.frontier)
+        moving = set(active)
+
+        population = self.population
+        with self.profiler.phase("move"):
+            idle = np.ones(len(population), dtype=bool)
+            idle[active] = False
+            idle = np.flatnonzero(idle)
+            destination = self.neighborhood.sample(self.positions[idle], self.rng)
+            movers = destination >= 0
+            idle, destination = idle[movers], destination[movers]
+            self.positions[idle] = destination
+            for agent, node in zip(population[idle].tolist(), destination.tolist()):
+                agent.pos = node
+            by_node = population[np.argsort(self.positions, kind='stable')].tolist()
+            ends = np.cumsum(np.bincount(self.positions, minlength=self.num_nodes)).tolist()
+            first = 0
+            for data, end in zip(self.node_agents, ends):
+                data["agent"] = by_node[first:end]
+                first = end
+
+        self.queue = active
+        while self.queue:
+            self.activating = i = heapq.heappop(self.queue)
+            if i in moving:
+                population[i].step()
+                self.positions[i] = population[i].pos
+            else:
+                population[i].advance()
+        self.activating = len(population)
 
 """model = NetworkModel(10, 3, 3)
 for i in range(10):
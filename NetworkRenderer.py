@@ -0,0 +1,37 @@
+import matplotlib.colors
+import matplotlib.pyplot as plt
+import networkx as nx
+import numpy as np
+
+from AgentStateRecorder import SUSCEPTIBLE, INFECTED, RECOVERED
+
+#A node takes the colour of its most severe occupant: infected over recovered over susceptible. Nodes nobody is standing on are grey.
+state_rank = np.zeros(3, dtype=np.int64)
+state_rank[[SUSCEPTIBLE, RECOVERED, INFECTED]] = [1, 2, 3]
+rank_names = ['lightgrey', 'blue', 'green', 'red']
+rank_colors = matplotlib.colors.to_rgba_array(rank_names)
+
+
+def node_ranks(states, positions, num_nodes):
+    #states[i] is agent i's state code (see AgentStateRecorder) and positions[i] the node it is on. Returns each node's index into rank_names.
+    rank = np.zeros(num_nodes, dtype=np.int64)
+    np.maximum.at(rank, np.asarray(positions), state_rank[np.asarray(states)])
+    return rank
+
+
+class NetworkRenderer:
+    """One matplotlib figure of the contact graph. Edges and nodes are drawn once, after which only the node colours change."""
+
+    def __init__(self, G, pos, figsize=(8, 8)):
+        self.num_nodes = G.number_of_nodes()
+        self.fig, self.ax = plt.subplots(figsize=figsize)
+        nx.draw_networkx_edges(G, pos, ax=self.ax, edge_color='black', width=0.6)
+        self.nodes = nx.draw_networkx_nodes(G, pos, nodelist=range(self.num_nodes), ax=self.ax, node_size=30, node_color='lightgrey')
+        self.ax.set_axis_off()
+
+    def update(self, states, positions):
+        self.nodes.set_facecolor(rank_colors[node_ranks(states, positions, self.num_nodes)])
+        return self.fig
+
+    def close(self):
+        plt.close(self.fig)
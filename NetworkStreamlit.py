@@ -1,10 +1,14 @@
 import streamlit as st
-from NetworkModel import NetworkModel
+from NetworkModel import NetworkModel, generate_graph
+from NetworkArrayEngine import graph_to_csr, csr_to_graph
+from NetworkRenderer import NetworkRenderer
+import collections
 import networkx as nx
 import matplotlib.pyplot as plt
 import mesa.visualization
 import pandas as pd
 import time
+import threading
 import matplotlib
 
 matplotlib.use('WebAgg')
@@ -36,6 +40,11 @@ with st.sidebar:
     graph_type_choice = st.selectbox("Graph type", options=['Barabasi Albert', 'Watts Strogatz', 'Erdos Renyi', 'Power Law Cluster'])
     p_value_slider = st.slider("P value", 0, 10, 4)
     m_value_slider = st.slider("M value", 0, 10, 3)
+    seed = st.number_input("Random seed", min_value=0, value=0, step=1)
+
+    st.title("Display")
+    #The graph is redrawn at most this often, however fast the simulation steps; the last step is always drawn
+    frames_per_second = st.slider("Graph frames per second", 1, 30, 10)
 
 with st.expander("Citations"):
     url1 = "https://pubmed.ncbi.nlm.nih.gov/11130187/"
@@ -49,116 +58,166 @@ with st.expander("Citations"):
 
 run = st.button("Run Simulation")
 
-model = NetworkModel(num_agents, infection_chance, graph_type_choice, m_value_slider, p_value_slider, num_recoveries_slider, num_steps_recoveries_slider,  age_risk, genetic_risk, tobacco_use, unhealthy_diet, insufficient_physical_activity, harmful_alcohol_use, income_multiplier, vaccination_rate, vaccination_efficacy)
-model.create_agents()
-
-def get_colors():
-    node_colors = []
-    edge_colors = ['black' for edge in G.edges]
-    for node_id in G.nodes:
-        agents = model.grid.get_cell_list_contents([node_id])
-        for agent in agents:
-            if agent.wealth == 1 and agent.recovered == 0:
-                node_colors.append('red')
-            elif agent.wealth == 0 and agent.recovered == 1:
-                node_colors.append('green')
-            elif agent.wealth == 0 and agent.recovered == 0:
-                node_colors.append('blue')
-    return node_colors, edge_colors
-
-def create_figure():
-    node_colors, edge_colors = get_colors()
-    fig, ax = plt.subplots(figsize=(8,8))
-    nx.draw(G, pos, node_color=node_colors, edge_color=edge_colors, width = 0.6, node_size=30)
-    return fig
+#Streamlit reruns this whole script on every widget change, so nothing is built until Run is pressed, and what is built is kept across reruns.
+#Graphs and their layouts only depend on the graph parameters and the seed, so changing an epidemic parameter reuses them.
+@st.cache_resource(max_entries=8)
+def load_graph(graph_type, N, m_value, p_value, seed):
+    return graph_to_csr(generate_graph(graph_type, N, m_value, p_value, seed))
+
+@st.cache_resource(max_entries=8)
+def load_layout(graph_type, N, m_value, p_value, seed):
+    return nx.spring_layout(csr_to_graph(*load_graph(graph_type, N, m_value, p_value, seed)), seed=seed % 2**32)
+
+class StreamlitGraphCache:
+    #Hands load_graph to NetworkModel in place of an on-disk GraphCache
+    def get_or_create(self, graph_type, N, m_value, p_value, seed, build, backend='networkx'):
+        return load_graph(graph_type, N, m_value, p_value, seed)
+
+class ChartFeed:
+    #One line chart that only sends the browser the rows added since its last update (add_rows), instead of the whole history every tick.
+    #Once more than max_points rows have been sent, the history is thinned to every other row and sent once more, and from then on only every stride-th step is kept. A run of any length therefore sends O(max_points) rows per chart.
+    def __init__(self, container, max_points=500):
+        self.container = container
+        self.max_points = max_points
+        self.chart = None
+        self.stride = 1
+        self.sent = []
+        self.pending = []
+
+    def push(self, step, row, last=False):
+        #The last step is always kept, so the chart ends where the run did
+        if step % self.stride == 0 or last:
+            self.pending.append((step, row))
+
+    def update(self):
+        if not self.pending:
+            return
+        self.sent.extend(self.pending)
+        if len(self.sent) > self.max_points:
+            self.stride *= 2
+            self.sent = [(step, row) for step, row in self.sent[:-1] if step % self.stride == 0] + self.sent[-1:]
+            self.chart = None
+        if self.chart is None:
+            self.chart = self.container.line_chart(chart_frame(self.sent))
+        else:
+            self.chart.add_rows(chart_frame(self.pending))
+        self.pending = []
+
+def chart_frame(rows):
+    return pd.DataFrame([row for _, row in rows], index=[step for step, _ in rows])
+
+#Finished runs by their parameters, most recently used last, so a configuration that was already run is shown without running it again
+max_finished_runs = 16
+
+class FinishedRuns:
+    #The finished runs, shared by every session through st.cache_resource. Sessions run in their own threads, so every access holds the lock.
+    def __init__(self, max_runs):
+        self.max_runs = max_runs
+        self.runs = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        #The run for `key`, now the most recently used, or None
+        with self.lock:
+            run = self.runs.get(key)
+            if run is not None:
+                self.runs.move_to_end(key)
+            return run
+
+    def put(self, key, run):
+        #Adds a run, dropping the least recently used ones over max_runs
+        with self.lock:
+            self.runs[key] = run
+            self.runs.move_to_end(key)
+            while len(self.runs) > self.max_runs:
+                self.runs.popitem(last=False)
+
+@st.cache_resource
+def finished_runs():
+    return FinishedRuns(max_finished_runs)
 
 def create_line_plot():
     fig, ax = plt.subplots(figsize=(4, 8))
     px.line(prevalence, incidence)
     return fig
 
-if run:
+parameters = (num_agents, infection_chance, graph_type_choice, m_value_slider, p_value_slider, num_recoveries_slider, num_steps_recoveries_slider,  age_risk, genetic_risk, tobacco_use, unhealthy_diet, insufficient_physical_activity, harmful_alcohol_use, income_multiplier, vaccination_rate, vaccination_efficacy)
+run_key = (parameters, num_ticks, int(seed))
+runs = finished_runs()
+finished = runs.get(run_key) if run else None
+
+if finished is not None:
+    results_df, states, positions, graph_seed = finished
+    G = csr_to_graph(*load_graph(graph_type_choice, num_agents, m_value_slider, p_value_slider, graph_seed))
+    pos = load_layout(graph_type_choice, num_agents, m_value_slider, p_value_slider, graph_seed)
+
+    st.text(f"Step = {num_ticks} (previous run)")
+    renderer = NetworkRenderer(G, pos)
+    st.pyplot(renderer.update(states, positions))
+    renderer.close()
+
+    st.write("Total Infections and Vaccinations")
+    st.line_chart(results_df[['Total Infections', 'Vaccinations']])
+    st.write("Prevalence and Incidence")
+    st.line_chart(results_df[['Prevalence', 'Incidence']])
+    st.write("SIR Graph")
+    st.line_chart(results_df[['Susceptible', 'Infected', 'Recovered']])
+    st.write("Prevalence by Risk Factor")
+    st.line_chart(results_df[['Prevalence - Age Risk', 'Prevalence - Genetic Risk', 'Prevalence - Tobacco', 'Prevalence - Diet', 'Prevalence - Physical Activity', 'Prevalence - Alcohol Use', 'Prevalence - Lifestyle Risk']].rename(columns=lambda name: name.replace('Prevalence - ', '').replace(' Risk', '').replace(' Use', '')))
+
+    with st.expander("Results dataframe"):
+        st.dataframe(results_df)
+
+elif run:
+    model = NetworkModel(*parameters, horizon=num_ticks + 1, seed=int(seed), graph_cache=StreamlitGraphCache())
+    model.create_agents()
+
     #init graph
     G = model.G
-    pos = nx.spring_layout(G)
+    pos = load_layout(graph_type_choice, num_agents, m_value_slider, p_value_slider, model.graph_seed)
 
     #init progress bar
     my_bar = st.progress(0, text="Simulation Progress")
     placeholder = st.empty()
 
     graph_container = st.empty()
+    renderer = NetworkRenderer(G, pos)
+    frame_interval = 1 / frames_per_second
+    last_frame = None
     
-    total_infections = []
-    vaccinations = []
-
-    prevalence = []
-    incidence = []
-
-    susceptible = []
-    infected = []
-    recovered = []
-
-    prevalence_age_risk = []
-    prevalence_genetic_risk = []
-    prevalence_tobacco_risk = []
-    prevalence_diet_risk = []
-    prevalence_physical_activity_risk = []
-    prevalence_alcohol_risk = []
-    prevalence_lifestyle_risk = []
-    prevalence_alcohol_risk = []
-    
-    line_plot_container1_title = st.empty()
-    line_plot_container1 = st.empty()
-    line_plot_container2_title = st.empty()
-    line_plot_container2 = st.empty()
-    line_plot_container3_title = st.empty()
-    line_plot_container3 = st.empty()
-    line_plot_container4_title = st.empty()
-    line_plot_container4 = st.empty()
+    st.write("Total Infections and Vaccinations")
+    chart1 = ChartFeed(st.empty())
+    st.write("Prevalence and Incidence")
+    chart2 = ChartFeed(st.empty())
+    st.write("SIR Graph")
+    chart3 = ChartFeed(st.empty())
+    st.write("Prevalence by Risk Factor")
+    chart4 = ChartFeed(st.empty())
 
     #simulation loop
     for i in range(num_ticks+1):
         model.step()
-        my_bar.progress((i / num_ticks), text="Simulation progress")
-        placeholder.text(f"Step = {i}")
-        fig = create_figure()
-        graph_container.pyplot(fig)
-
-        total_infections.append(model.total_infections)
-        vaccinations.append(model.vaccinations)
-
-        prevalence.append(model.prevalence)
-        incidence.append(model.incidence)
-
-        susceptible.append(model.susceptible)
-        infected.append(model.infected)
-        recovered.append(model.recovered)
-
-        prevalence_age_risk.append(model.prevalence_age_risk)
-        prevalence_genetic_risk.append(model.prevalence_genetic_risk)
-        prevalence_tobacco_risk.append(model.prevalence_tobacco_risk)
-        prevalence_diet_risk.append(model.prevalence_diet_risk)
-        prevalence_physical_activity_risk.append(model.prevalence_physical_activity_risk)
-        prevalence_alcohol_risk.append(model.prevalence_alcohol_risk)
-        prevalence_lifestyle_risk.append(model.prevalence_lifestyle_risk)
-
-        chart1 = {'Total Infections': total_infections, 'Vaccinations': vaccinations}
-        chart2 = {'Prevalence': prevalence, 'Incidence': incidence}
-        chart3 = {'Susceptible': susceptible, 'Infected': infected, 'Recovered': recovered}
-        chart4 = {'Age': prevalence_age_risk, 'Genetic': prevalence_genetic_risk, 'Tobacco': prevalence_tobacco_risk, 'Diet': prevalence_diet_risk, 'Physical Activity': prevalence_physical_activity_risk, 'Alcohol': prevalence_alcohol_risk, 'Lifestyle': prevalence_lifestyle_risk}
-
-        line_plot_container1_title.write("Total Infections and Vaccinations")
-        line_plot_container1.line_chart(chart1)
-        line_plot_container2_title.write("Prevalence and Incidence")
-        line_plot_container2.line_chart(chart2)
-        line_plot_container3_title.write("SIR Graph")
-        line_plot_container3.line_chart(chart3)
-        line_plot_container4_title.write("Prevalence by Risk Factor")
-        line_plot_container4.line_chart(chart4)
-
-        time.sleep(0.1)
-    
+        redraw = False
+        now = time.perf_counter()
+        if last_frame is None or now - last_frame >= frame_interval or i == num_ticks:
+            my_bar.progress((i / num_ticks), text="Simulation progress")
+            placeholder.text(f"Step = {i}")
+            graph_container.pyplot(renderer.update(model.state_recorder.current, model.agent_positions()))
+            last_frame = now
+            redraw = True
+
+        last = i == num_ticks
+        chart1.push(i, {'Total Infections': model.total_infections, 'Vaccinations': model.vaccinations}, last)
+        chart2.push(i, {'Prevalence': model.prevalence, 'Incidence': model.incidence}, last)
+        chart3.push(i, {'Susceptible': model.susceptible, 'Infected': model.infected, 'Recovered': model.recovered}, last)
+        chart4.push(i, {'Age': model.prevalence_age_risk, 'Genetic': model.prevalence_genetic_risk, 'Tobacco': model.prevalence_tobacco_risk, 'Diet': model.prevalence_diet_risk, 'Physical Activity': model.prevalence_physical_activity_risk, 'Alcohol': model.prevalence_alcohol_risk, 'Lifestyle': model.prevalence_lifestyle_risk}, last)
+        if redraw:
+            for chart in (chart1, chart2, chart3, chart4):
+                chart.update()
+
+    renderer.close()
     results_df = model.results_df
+    runs.put(run_key, (results_df, model.state_recorder.current.copy(), model.agent_positions().copy(), model.graph_seed))
     with st.expander("Results dataframe"):
         st.dataframe(results_df)
 
@@ -0,0 +1,178 @@
+import mmap
+import multiprocessing
+import os
+import weakref
+
+import numpy as np
+
+from EpidemicCounters import EpidemicCounters
+from GraphPartition import partition_graph
+from NetworkArrayEngine import NetworkArrayEngine
+
+#The per-agent arrays, which the worker processes change and so are kept in shared memory
+shared_attributes = ("pos", "wealth", "steps", "recovered", "num_recoveries", "chance_of_infection", "vaccinated", "increase_age_risk", "increase_genetic_risk",
+                     "increase_tobacco_use", "increase_unhealthy_diet", "increase_physical_activity", "increase_alcohol_use", "increase_lifestyle_risk", "susceptibility")
+
+
+def shared_array(array):
+    #A copy of `array` in shared memory: processes forked after it is made see each other's changes to it
+    buffer = mmap.mmap(-1, max(array.nbytes, 1))
+    shared = np.frombuffer(buffer, dtype=array.dtype, count=array.size).reshape(array.shape)
+    shared[...] = array
+    return shared
+
+def group(agents, owner):
+    #{part: the agents whose owner is that part}
+    order = np.argsort(owner, kind='stable')
+    parts, first = np.unique(owner[order], return_index=True)
+    return dict(zip(parts.tolist(), np.split(agents[order], first[1:])))
+
+def stop_workers(connections, processes):
+    for connection in connections:
+        try:
+            connection.send(("stop",))
+        except OSError:
+            pass
+    for process in processes:
+        process.join(timeout=5)
+        if process.is_alive():
+            process.terminate()
+
+
+class PartitionedEngine(NetworkArrayEngine):
+    """NetworkArrayEngine that splits the contact graph into parts and steps the agents on each part in its own worker process."""
+
+    #The agent state is in shared memory that the workers are forked onto, and every agent belongs to the part its node is in. A step is four rounds of one message from the parent to every worker and one reply:
+    #move: each worker moves its agents, and sends back the ones that left its part, which the parent passes on to their new owners.
+    #index: each worker lists its agents by node in the shared order array, at the offset the parent gives it, so every worker can look up the agents on any node.
+    #infect: each worker works out whom its infectious agents infect, reading but not changing the agents on other parts. The infections on other parts (the halo) are sent back, and passed on to their owners.
+    #apply: each worker infects its agents, counts their steps and recovers them, and sends back its changes to the counters, new cases and vaccinations, which the parent adds to the model's.
+    #The workers draw from Generators seeded every step from the model's rng, so a run is reproducible for a given seed and number of parts, and a checkpoint holds all of its random state.
+    #Another number of parts gives another run, statistically equivalent to the array engine's. The workers take the model's parameters as they are at the first step.
+
+    def __init__(self, model):
+        super().__init__(model)
+        n = model.num_nodes
+        for name in shared_attributes:
+            setattr(self, name, shared_array(getattr(self, name)))
+        #The agents sorted by node: the agents on node v are order[start[v]:start[v] + counts[v]]
+        self.order = shared_array(np.zeros(n, dtype=np.int64))
+        self.start = shared_array(np.zeros(n, dtype=np.int64))
+        self.counts = shared_array(np.zeros(n, dtype=np.int64))
+
+        #In the long run the agents on a node are proportional to the size of its neighborhood (see MeanField.contact_classes), and every node starts with one
+        self.parts = max(min(model.partitions or os.cpu_count(), n), 1)
+        self.part = partition_graph(self.indptr, self.indices, self.parts, weights=self.neighborhood.sizes() + 1, method=model.partitioner)
+        self._connections = None
+
+    def start_workers(self):
+        context = multiprocessing.get_context("fork")
+        self._connections = []
+        processes = []
+        #Taken before any worker starts, since the ones started first may already be moving agents when the others start
+        owner = self.part[self.pos]
+        for part in range(self.parts):
+            connection, worker_connection = context.Pipe()
+            process = context.Process(target=self._serve, args=(part, np.flatnonzero(owner == part), worker_connection), daemon=True)
+            process.start()
+            worker_connection.close()
+            self._connections.append(connection)
+            processes.append(process)
+        self._stop = weakref.finalize(self, stop_workers, self._connections, processes)
+
+    def close(self):
+        #Stops the worker processes; the next step starts them again
+        if self._connections is not None:
+            self._stop()
+            self._connections = None
+
+    def _exchange(self, messages):
+        for connection, message in zip(self._connections, messages):
+            connection.send(message)
+        replies = [connection.recv() for connection in self._connections]
+        for reply in replies:
+            if isinstance(reply, Exception):
+                self.close()
+                raise reply
+        return replies
+
+    def _route(self, groups):
+        #What every part was sent by the others, as one array per part
+        empty = np.zeros(0, dtype=np.int64)
+        return [np.concatenate([empty] + [sent[part] for sent in groups if part in sent]) for part in range(self.parts)]
+
+    def step(self):
+        if self._connections is None:
+            self.start_workers()
+        model = self.model
+        profiler = model.profiler
+        seeds = np.random.SeedSequence(int(self.rng.integers(2**63))).spawn(self.parts)
+
+        with profiler.phase("move"):
+            moved = self._exchange([("move", seed) for seed in seeds])
+            arrivals = self._route([leaving for staying, leaving in moved])
+            sizes = np.array([staying for staying, leaving in moved]) + [len(agents) for agents in arrivals]
+            offsets = np.cumsum(sizes) - sizes
+            self._exchange([("index", agents, int(offset)) for agents, offset in zip(arrivals, offsets)])
+
+        with profiler.phase("give_disease"):
+            halo = self._route(self._exchange([("infect",)] * self.parts))
+
+        with profiler.phase("recovery"):
+            for counters, new_cases, vaccinations in self._exchange([("apply", agents) for agents in halo]):
+                model.counters.merge(counters)
+                model.new_cases += new_cases
+                model.vaccinations += vaccinations
+
+    def _serve(self, part, mine, connection):
+        #The loop of the worker for `part`, which starts with the agents `mine`, in its own process, where this engine and its model are copies of the parent's
+        for other in self._connections:
+            other.close()
+        model = self.model
+        nodes = np.flatnonzero(self.part == part)
+        while True:
+            try:
+                message = connection.recv()
+            except EOFError:
+                return
+            command = message[0]
+            if command == "stop":
+                return
+            try:
+                if command == "move":
+                    #The counters, new cases and vaccinations here only count this step's changes
+                    self.rng = np.random.default_rng(message[1])
+                    model.counters = EpidemicCounters(model.num_recoveries_for_immune)
+                    model.new_cases = 0
+                    model.vaccinations = 0
+                    destination = self.neighborhood.sample(self.pos[mine], self.rng)
+                    movers = destination >= 0
+                    self.pos[mine[movers]] = destination[movers]
+                    owner = self.part[self.pos[mine]]
+                    leaving = owner != part
+                    connection.send((int((~leaving).sum()), group(mine[leaving], owner[leaving])))
+                    mine = mine[~leaving]
+                elif command == "index":
+                    arrivals, offset = message[1:]
+                    mine = np.sort(np.concatenate([mine, arrivals]))
+                    by_node = mine[np.argsort(self.pos[mine], kind='stable')]
+                    self.order[offset:offset + len(mine)] = by_node
+                    self.counts[nodes] = 0
+                    occupied, first, counts = np.unique(self.pos[by_node], return_index=True, return_counts=True)
+                    self.counts[occupied] = counts
+                    self.start[occupied] = offset + first
+                    connection.send(None)
+                elif command == "infect":
+                    infectious = self.wealth[mine] == 1
+                    new_cases = self.transmit(mine[infectious], self.order, self.start, self.counts)
+                    owner = self.part[self.pos[new_cases]]
+                    local = new_cases[owner == part]
+                    connection.send(group(new_cases[owner != part], owner[owner != part]))
+                elif command == "apply":
+                    #A target reached from several parts is only infected once
+                    self.infect(np.unique(np.concatenate([local, message[1]])))
+                    self.steps[mine] = np.where(infectious, self.steps[mine] + 1, 0)
+                    self.recover(mine)
+                    connection.send((model.counters, model.new_cases, model.vaccinations))
+            except Exception as error:
+                connection.send(error)
@@ -0,0 +1,99 @@
+import time
+from collections import defaultdict
+
+import pandas as pd
+
+clock = time.perf_counter
+
+
+class PhaseProfiler:
+    """Wall time and call counts per phase of a model step, kept as one row per step."""
+
+    #Every instrumented phase is wrapped as
+    #    with profiler.phase("move"):
+    #        ...
+    #Models that are not being profiled hold a NullProfiler instead, whose phases do nothing.
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.rows = []
+        self._frame = None
+
+    def phase(self, name):
+        return Phase(self, name)
+
+    def add(self, phase, start):
+        self.seconds[phase] += clock() - start
+        self.calls[phase] += 1
+
+    def end_step(self, step):
+        row = {"Step": step}
+        for phase in self.seconds:
+            row[f"{phase} seconds"] = self.seconds[phase]
+            row[f"{phase} calls"] = self.calls[phase]
+        self.rows.append(row)
+        self.seconds.clear()
+        self.calls.clear()
+        self._frame = None
+
+    def to_frame(self):
+        #Phases are nested: "agents" covers the whole activation, including the "move", "give_disease", ... time inside it
+        if self._frame is None:
+            frame = pd.DataFrame(self.rows)
+            calls = [name for name in frame.columns if name.endswith(" calls")]
+            frame[calls] = frame[calls].fillna(0).astype('int64')
+            self._frame = frame.fillna(0.0)
+        return self._frame
+
+    def summary(self):
+        #Totals over the whole run, slowest phase first
+        frame = self.to_frame()
+        phases = [name[:-len(" seconds")] for name in frame.columns if name.endswith(" seconds")]
+        summary = pd.DataFrame({
+            "seconds": [frame[f"{phase} seconds"].sum() for phase in phases],
+            "calls": [frame[f"{phase} calls"].sum() for phase in phases],
+        }, index=pd.Index(phases, name="phase"))
+        return summary.sort_values("seconds", ascending=False)
+
+
+class Phase:
+    """One timed run of a phase, as a context manager."""
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = clock()
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, self.start)
+
+
+class NoPhase:
+    """A phase that is not timed. Cheaper to enter than contextlib.nullcontext, which matters in the per-agent phases."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+#Shared by every phase of every NullProfiler
+no_phase = NoPhase()
+
+class NullProfiler:
+    """Stands in for a PhaseProfiler when a model is not being profiled."""
+
+    def phase(self, name):
+        return no_phase
+
+    def end_step(self, step):
+        pass
+
+    def to_frame(self):
+        return None
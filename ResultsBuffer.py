@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+
+
+class ResultsBuffer:
+    """Growable columnar store of one row per model step, read back as a DataFrame on demand."""
+
+    def __init__(self, columns, capacity=256, sink=None, flush_every=None):
+        #columns maps each column name to its NumPy dtype. When the number of steps is known, pass it as the capacity and the buffer never reallocates.
+        #With a sink (e.g. a ResultsSink.ParquetSink), every flush_every rows are written out and dropped from memory, so only that many are ever held.
+        self.dtypes = dict(columns)
+        self.sink = sink
+        self.flush_every = flush_every
+        if sink is not None and flush_every:
+            capacity = min(capacity, flush_every)
+        self.capacity = max(int(capacity), 1)
+        self.size = 0
+        #Rows already written to the sink
+        self.flushed = 0
+        self.data = {name: np.zeros(self.capacity, dtype=dtype) for name, dtype in self.dtypes.items()}
+        self._frame = None
+
+    def __len__(self):
+        return self.flushed + self.size
+
+    def _grow(self):
+        #Doubling keeps appends amortized O(1)
+        self.capacity *= 2
+        for name, values in self.data.items():
+            grown = np.zeros(self.capacity, dtype=values.dtype)
+            grown[:self.size] = values[:self.size]
+            self.data[name] = grown
+
+    def append(self, row):
+        if self.size == self.capacity:
+            self._grow()
+        for name, values in self.data.items():
+            values[self.size] = row[name]
+        self.size += 1
+        self._frame = None
+        self._maybe_flush()
+
+    def extend(self, columns):
+        #Appends many rows at once, given as one array per column
+        count = len(next(iter(columns.values())))
+        while self.size + count > self.capacity:
+            self._grow()
+        for name, values in self.data.items():
+            values[self.size:self.size + count] = columns[name]
+        self.size += count
+        self._frame = None
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if self.sink is not None and self.flush_every and self.size >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        #Writes the rows held in memory to the sink as one chunk
+        if self.sink is None or self.size == 0:
+            return
+        self.sink.write({name: values[:self.size] for name, values in self.data.items()})
+        self.flushed += self.size
+        self.size = 0
+        self._frame = None
+
+    def column(self, name):
+        #The whole column, reading back any flushed rows from the sink
+        if self.flushed:
+            flushed = self.sink.read(columns=[name])[name].to_numpy(dtype=self.dtypes[name])
+            return np.concatenate([flushed, self.data[name][:self.size]])
+        return self.data[name][:self.size]
+
+    def to_frame(self):
+        #Built once per new row, however many times it is read in between
+        if self._frame is None:
+            frame = pd.DataFrame({name: values[:self.size] for name, values in self.data.items()}, copy=False)
+            if self.flushed:
+                flushed = self.sink.read(columns=list(self.dtypes)).astype(self.dtypes)
+                frame = pd.concat([flushed, frame], ignore_index=True)
+            self._frame = frame
+        return self._frame
@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+class ParquetSink:
+    """Directory of Parquet chunk files that a run's rows are flushed to while it is going."""
+
+    def __init__(self, directory, index=None):
+        #With an index name, every row is also written with its position in the run under that name (e.g. "Step")
+        self.directory = directory
+        self.index = index
+        os.makedirs(directory, exist_ok=True)
+        #Continue after the chunks already there, so a resumed run appends instead of overwriting
+        self.chunks = len([name for name in os.listdir(directory) if name.startswith("part-") and name.endswith(".parquet")])
+        self.rows = 0
+        if index is not None and self.chunks:
+            self.rows = pq.ParquetDataset(directory).read(columns=[]).num_rows
+
+    def write(self, columns):
+        table = pa.table(columns)
+        if self.index is not None:
+            table = table.append_column(self.index, pa.array(np.arange(self.rows, self.rows + table.num_rows)))
+        name = f"part-{self.chunks:06d}.parquet"
+        #Each chunk is complete once renamed into place, so a crash loses at most the rows not yet flushed. Readers skip the dot-prefixed temporary file.
+        tmp = os.path.join(self.directory, "." + name)
+        pq.write_table(table, tmp)
+        os.replace(tmp, os.path.join(self.directory, name))
+        self.chunks += 1
+        self.rows += table.num_rows
+
+    def resume(self, rows):
+        #Continues a run whose first `rows` rows were written here, deleting the chunks it wrote after them (e.g. after the checkpoint it is resumed from). Returns how many of the rows are here: `rows`, or 0 for an empty directory.
+        names = sorted(name for name in os.listdir(self.directory) if name.startswith("part-") and name.endswith(".parquet"))
+        ends = np.cumsum([0] + [pq.ParquetFile(os.path.join(self.directory, name)).metadata.num_rows for name in names])
+        if not names:
+            return 0
+        if rows not in ends:
+            raise ValueError(f"{self.directory} holds {ends[-1]} rows, in chunks none of which ends at row {rows}; it is not where this run was written")
+        kept = int(np.searchsorted(ends, rows))
+        for name in names[kept:]:
+            os.remove(os.path.join(self.directory, name))
+        self.chunks = kept
+        self.rows = rows
+        return rows
+
+    def read(self, columns=None):
+        return read_results(self.directory, columns=columns)
+
+
+def read_results(path, columns=None, filter=None):
+    #Reads every chunk under `path` lazily. Only the requested columns are loaded, and directories named like "replicate=3" become columns.
+    #e.g. read_results("runs/", columns=["replicate", "Prevalence"]) pulls one metric across all runs without loading the rest.
+    #Files whose names start with "." or "_" (temporary chunks, run metadata) are skipped.
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    return dataset.to_table(columns=columns, filter=filter).to_pandas()
@@ -0,0 +1,167 @@
+import numpy as np
+import pandas as pd
+
+
+class RunningMoments:
+    """Running mean and variance of one column over every step, updated in O(1) per step (Welford's algorithm)."""
+
+    def __init__(self, column):
+        self.column = column
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, step, value):
+        #Steps where the column is NaN, e.g. the prevalence of a stratum nobody is in, are left out
+        value = float(value)
+        if value != value:
+            return
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def result(self):
+        #The sample variance, as pandas' var() gives
+        return {f"{self.column} mean": self.mean if self.count else float('nan'),
+                f"{self.column} variance": self.m2 / (self.count - 1) if self.count > 1 else float('nan')}
+
+
+class Peak:
+    """The largest value of one column and the first step it was reached at."""
+
+    def __init__(self, column):
+        self.column = column
+        self.value = float('-inf')
+        self.step = None
+
+    def update(self, step, value):
+        value = float(value)
+        if value > self.value:
+            self.value = value
+            self.step = int(step)
+
+    def result(self):
+        return {f"{self.column} peak": self.value if self.step is not None else float('nan'), f"{self.column} time to peak": self.step}
+
+
+def default_aggregates():
+    return [RunningMoments("Prevalence"), Peak("Prevalence")]
+
+def trim_model_vars(datacollector, window):
+    #Keeps a DataCollector's model_vars to the last `window` steps (between window and 2 * window values, so the trimming is amortized O(1) per step). Charts only ever read the latest value.
+    for values in datacollector.model_vars.values():
+        if len(values) >= 2 * window:
+            del values[:-window]
+
+
+class RollingResults:
+    """Bounded-memory stand-in for ResultsBuffer: the last `window` rows in full, an evenly thinned sample of the older rows, and online aggregates over every row."""
+
+    #A row leaving the window is kept in the history if its step is a multiple of the stride, which starts at decimate_every. The history holds at most `history` rows (by default `window`):
+    #when it is full every other row is dropped and the stride doubles, so it always spans the whole run and memory stays O(window + history) however long the run goes.
+    #The aggregates (by default RunningMoments and Peak of "Prevalence") see every row as it is appended, so what they compute is exact. Any object with a `column`, update(step, value) and result() (a dict) can be one.
+
+    def __init__(self, columns, window, decimate_every=1, history=None, aggregates=None):
+        if window < 1 or decimate_every < 1:
+            raise ValueError(f"The retention window and decimate_every must be at least 1, got {window} and {decimate_every}")
+        self.dtypes = dict(columns)
+        self.window = int(window)
+        self.stride = int(decimate_every)
+        self.history_capacity = max(int(window if history is None else history), 1)
+        self.aggregates = default_aggregates() if aggregates is None else list(aggregates)
+        #Rows appended so far; row i is step i
+        self.rows = 0
+        self.data = {name: np.zeros(self.window, dtype=dtype) for name, dtype in self.dtypes.items()}
+        self.history = {name: np.zeros(self.history_capacity, dtype=dtype) for name, dtype in self.dtypes.items()}
+        self.history_steps = np.zeros(self.history_capacity, dtype=np.int64)
+        self.history_size = 0
+        self._frame = None
+
+    def __len__(self):
+        return self.rows
+
+    def append(self, row):
+        step = self.rows
+        for aggregate in self.aggregates:
+            aggregate.update(step, row[aggregate.column])
+        slot = step % self.window
+        if step >= self.window:
+            self._retire(step - self.window, slot)
+        for name, values in self.data.items():
+            values[slot] = row[name]
+        self.rows += 1
+        self._frame = None
+
+    def extend(self, columns):
+        count = len(next(iter(columns.values())))
+        for i in range(count):
+            self.append({name: values[i] for name, values in columns.items()})
+
+    def _retire(self, step, slot):
+        #The row of `step` leaves the window from `slot`
+        if step % self.stride:
+            return
+        if self.history_size == self.history_capacity:
+            keep = self.history_steps[:self.history_size] % (2 * self.stride) == 0
+            self.history_size = int(keep.sum())
+            self.history_steps[:self.history_size] = self.history_steps[:len(keep)][keep]
+            for name, values in self.history.items():
+                values[:self.history_size] = values[:len(keep)][keep]
+            self.stride *= 2
+            if step % self.stride:
+                return
+        self.history_steps[self.history_size] = step
+        for name, values in self.history.items():
+            values[self.history_size] = self.data[name][slot]
+        self.history_size += 1
+
+    def flush(self):
+        #Nothing is written out; kept so the models can treat this like a ResultsBuffer
+        pass
+
+    def _window_slots(self):
+        first = max(self.rows - self.window, 0)
+        return np.arange(first, self.rows) % self.window
+
+    def steps(self):
+        #The steps of the rows that are kept, in order
+        return np.concatenate([self.history_steps[:self.history_size], np.arange(max(self.rows - self.window, 0), self.rows)])
+
+    def column(self, name):
+        return np.concatenate([self.history[name][:self.history_size], self.data[name][self._window_slots()]])
+
+    def to_frame(self):
+        #Indexed by step, so it lines up with the rows of the full results
+        if self._frame is None:
+            self._frame = pd.DataFrame({name: self.column(name) for name in self.dtypes}, index=self.steps())
+        return self._frame
+
+    def summary(self):
+        #Every aggregate's results, in one dict
+        summary = {}
+        for aggregate in self.aggregates:
+            summary.update(aggregate.result())
+        return summary
+
+    def state(self):
+        #Everything but the kept rows, as JSON values (see Checkpoint.buffer_arrays)
+        return {"rows": self.rows, "stride": self.stride, "aggregates": [[type(aggregate).__name__, vars(aggregate)] for aggregate in self.aggregates]}
+
+    def restore(self, state, steps, columns):
+        saved = [name for name, values in state["aggregates"]]
+        if saved != [type(aggregate).__name__ for aggregate in self.aggregates]:
+            raise ValueError(f"The checkpoint has the aggregates {saved}; pass the same ones to restore it")
+        for aggregate, (name, values) in zip(self.aggregates, state["aggregates"]):
+            vars(aggregate).update(values)
+        self.rows = state["rows"]
+        self.stride = state["stride"]
+        windowed = steps >= self.rows - self.window
+        if (~windowed).sum() > self.history_capacity:
+            raise ValueError(f"The checkpoint keeps {int((~windowed).sum())} rows of history, more than this model's {self.history_capacity}")
+        self.history_size = int((~windowed).sum())
+        self.history_steps[:self.history_size] = steps[~windowed]
+        for name in self.dtypes:
+            self.history[name][:self.history_size] = columns[name][~windowed]
+            self.data[name][steps[windowed] % self.window] = columns[name][windowed]
+        self._frame = None
@@ -0,0 +1,112 @@
+import argparse
+import datetime
+import json
+import os
+import time
+
+#Runs NetworkModel or MoneyModel scenarios without any UI, e.g. from a scheduled job:
+#    python batch.py scenario.json --output-dir runs/
+#A scenario file holds one scenario or a list of them (JSON, or YAML if PyYAML is installed), each like
+#    {"name": "baseline", "model": "network", "ticks": 500, "replicates": 3, "seed": 1,
+#     "parameters": {"N": 1000, "chance_of_infection": 30, "graph_type": "Barabasi Albert", ...}}
+#"parameters" are the model's keyword arguments. A run stops early once the model stops running; NetworkModel runs are built with stop_on_extinction, so they stop as soon as nobody is infected.
+#Each run is written to <output dir>/<name>/replicate-<k>.csv (or .parquet), and one line per run is appended to <output dir>/runs.jsonl.
+#With --checkpoint-every K, a run saves a checkpoint (see Checkpoint) every K steps next to its results, and a run that finds one picks up from it, so a preempted job can simply be started again. The checkpoint is deleted once the run's results are written.
+#For very long runs, a "retention_window" parameter bounds the memory the results take (see RollingResults); the run's summary statistics then go into its runs.jsonl line.
+#Only the model modules are imported, never a visualization stack.
+
+
+def load_scenarios(path):
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            import yaml
+            scenarios = yaml.safe_load(f)
+        else:
+            scenarios = json.load(f)
+    if isinstance(scenarios, dict):
+        scenarios = [scenarios]
+    for i, scenario in enumerate(scenarios):
+        scenario.setdefault("name", f"scenario-{i}")
+        if scenario.get("model") not in ("network", "money"):
+            raise ValueError(f"Scenario {scenario['name']!r}: model must be 'network' or 'money'")
+        if "ticks" not in scenario:
+            raise ValueError(f"Scenario {scenario['name']!r}: missing 'ticks'")
+    return scenarios
+
+def build_model(scenario, seed):
+    parameters = dict(scenario.get("parameters", {}))
+    if scenario["model"] == "network":
+        from NetworkModel import NetworkModel
+        parameters.setdefault("stop_on_extinction", True)
+        model = NetworkModel(**parameters, horizon=scenario["ticks"], seed=seed)
+        model.create_agents()
+        return model
+    from MoneyModel import MoneyModel
+    return MoneyModel(**parameters, seed=seed)
+
+def load_model(scenario, path):
+    if scenario["model"] == "network":
+        from NetworkModel import NetworkModel
+        return NetworkModel.from_checkpoint(path)
+    from MoneyModel import MoneyModel
+    return MoneyModel.from_checkpoint(path)
+
+def steps_taken(scenario, model):
+    #MoneyModel counts its steps on the schedule
+    return model.steps if scenario["model"] == "network" else model.schedule.steps
+
+def run_scenario(scenario, output_dir, file_format, checkpoint_every=None):
+    directory = os.path.join(output_dir, scenario["name"])
+    os.makedirs(directory, exist_ok=True)
+    for replicate in range(scenario.get("replicates", 1)):
+        #Replicate k of a seeded scenario gets seed + k, so every replicate is reproducible and they differ from each other
+        seed = None if scenario.get("seed") is None else scenario["seed"] + replicate
+        start = time.perf_counter()
+        checkpoint = os.path.join(directory, f"replicate-{replicate}.checkpoint.npz")
+        if checkpoint_every and os.path.exists(checkpoint):
+            model = load_model(scenario, checkpoint)
+        else:
+            model = build_model(scenario, seed)
+        steps = resumed_from = steps_taken(scenario, model)
+        while steps < scenario["ticks"] and model.running:
+            model.step()
+            steps += 1
+            if checkpoint_every and steps % checkpoint_every == 0:
+                model.save_checkpoint(checkpoint)
+
+        results = model.results_df
+        if model.retention_window is not None:
+            #Only some steps are kept, so each row says which step it is
+            results = results.rename_axis("Step").reset_index()
+        path = os.path.join(directory, f"replicate-{replicate}.{file_format}")
+        if file_format == "parquet":
+            results.to_parquet(path, index=False)
+        else:
+            results.to_csv(path, index=False)
+
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        record = {"timestamp": datetime.datetime.now().isoformat(timespec='seconds'), "scenario": scenario["name"], "model": scenario["model"],
+                  "replicate": replicate, "seed": seed, "steps": steps, "ticks": scenario["ticks"], "stopped_early": steps < scenario["ticks"],
+                  "resumed_from": resumed_from, "seconds": round(time.perf_counter() - start, 3), "path": path}
+        #With a retention_window the aggregates over the whole run, since the results file only has the steps that were kept
+        if model.results_summary:
+            record["summary"] = model.results_summary
+        with open(os.path.join(output_dir, "runs.jsonl"), "a") as f:
+            f.write(json.dumps(record) + "\n")
+        print(f"{scenario['name']} replicate {replicate}: {steps} steps{' (stopped early)' if record['stopped_early'] else ''} -> {path}", flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run epidemic scenarios headless and write their results.")
+    parser.add_argument("scenario", help="scenario file (.json, or .yaml/.yml)")
+    parser.add_argument("--output-dir", default="output_data")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--checkpoint-every", type=int, default=None, metavar="K", help="save a checkpoint every K steps and resume from it if the run is started again")
+    args = parser.parse_args()
+
+    for scenario in load_scenarios(args.scenario):
+        run_scenario(scenario, args.output_dir, args.format, args.checkpoint_every)
+
+if __name__ == "__main__":
+    main()
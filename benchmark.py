@@ -0,0 +1,189 @@
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import subprocess
+import time
+
+import numpy as np
+
+#Times the hot paths of NetworkModel and MoneyModel over a range of population sizes, with fixed seeds so every run measures the same work.
+#Each run appends one JSON line per measurement to the history file; with a baseline file the timings are compared against it and regressions are flagged.
+#e.g.  python benchmark.py --sizes 100 1000 10000 100000 --save-baseline
+#      python benchmark.py --sizes 100 1000 10000 100000          (exits with status 1 on a regression)
+#Only the network family runs by default. MoneyModel is written for Mesa 2 (it uses mesa.time), so run --models money in an environment with that release.
+#A family that fails, e.g. on import, is reported as skipped and the others still run; the timings that completed are always saved.
+
+graph_types = ['Barabasi Albert', 'Watts Strogatz', 'Erdos Renyi', 'Power Law Cluster']
+#networkx's Erdos Renyi generator visits every pair of nodes, so above this size only the native generator is timed
+max_erdos_renyi_nodes = 10**4
+
+network_parameters = dict(chance_of_infection=30, m_value=3, num_recoveries_for_immune=3, num_steps=3, age_risk_proportion=30, genetic_risk_proportion=30,
+                          tobacco_risk_proportion=30, unhealthy_diet_proportion=30, physical_activity_proportion=30, alcohol_use_proportion=30,
+                          income_multiplier=1.2, vaccination_rate=30, vaccination_efficacy=75)
+money_parameters = dict(recovery_size=3, infectious_size=3, chance_of_infection=30, age_risk=30, genetic_risk=30, lifestyle_risk=30, death_risk=10, steps_to_death=30)
+
+
+def best_of(repeat, setup, run):
+    #Fastest of `repeat` timings of run(setup()), in seconds; the setup is not timed
+    times = []
+    for i in range(repeat):
+        state = setup()
+        start = time.perf_counter()
+        run(state)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def network_benchmarks(N, repeat, steps, seed):
+    from NetworkModel import NetworkModel
+
+    for graph_type in graph_types:
+        #Erdos Renyi and Watts Strogatz take p_value/10 as a probability; for Erdos Renyi it is chosen here for a mean degree of 6 at every size
+        p_value = 60 / N if graph_type == 'Erdos Renyi' else 4
+        make = lambda engine='agents', graph_backend='networkx': NetworkModel(N=N, graph_type=graph_type, p_value=p_value, engine=engine, horizon=steps, seed=seed, graph_backend=graph_backend, **network_parameters)
+
+        #Model construction with the CSR generators of GraphGenerators, which never build a networkx graph
+        yield "network.init", {"graph_type": graph_type, "graph_backend": "native"}, best_of(repeat, lambda: None, lambda _: make(graph_backend='native'))
+        if graph_type == 'Erdos Renyi' and N > max_erdos_renyi_nodes:
+            continue
+
+        def created(engine='agents'):
+            model = make(engine)
+            model.create_agents()
+            return model
+
+        labels = {"graph_type": graph_type}
+
+        yield "network.init", labels, best_of(repeat, lambda: None, lambda _: make())
+
+        for engine in ('agents', 'array', 'partitioned'):
+            labels = {"graph_type": graph_type, "engine": engine}
+            yield "network.create_agents", labels, best_of(repeat, lambda: make(engine), lambda model: model.create_agents())
+            #Per step, averaged over `steps` steps
+            yield "network.step", labels, best_of(repeat, lambda: created(engine), lambda model: [model.step() for i in range(steps)]) / steps
+
+        labels = {"graph_type": graph_type}
+        #The reporter phase alone: every compute_* function, as DataCollector.collect and step() call them
+        reporters = lambda model: [[reporter(model) for reporter in model.datacollector.model_reporters.values()] for i in range(steps)]
+        yield "network.reporters", labels, best_of(repeat, created, reporters) / steps
+
+        def grow(model):
+            #results_df growth: `steps` rows appended, with the frame read back after each one as the UI does
+            row = {name: 0 for name in model.results.data}
+            for i in range(steps):
+                model.results.append(row)
+                model.results_df
+        yield "network.results_df", labels, best_of(repeat, created, grow) / steps
+
+def money_benchmarks(N, repeat, steps, seed):
+    from MoneyModel import MoneyModel
+
+    #About 2.5 agents per cell, as in main.py's 250 agents on a 10 x 10 grid
+    side = max(10, math.ceil(math.sqrt(N / 2.5)))
+    make = lambda engine='agents': MoneyModel(N=N, width=side, height=side, engine=engine, seed=seed, **money_parameters)
+    labels = {"width": side, "height": side}
+
+    yield "money.init", labels, best_of(repeat, lambda: None, lambda _: make())
+
+    for engine in ('agents', 'array'):
+        #Per step, zone checks included
+        yield "money.step", {**labels, "engine": engine}, best_of(repeat, lambda: make(engine), lambda model: [model.step() for i in range(steps)]) / steps
+
+    def zone_checks(model):
+        for agent in model.population:
+            agent.in_recovery_zone()
+            agent.in_infectious_zone()
+    yield "money.zone_checks", labels, best_of(repeat, make, zone_checks)
+
+def case_key(case, labels, N):
+    return "|".join([case] + [f"{name}={value}" for name, value in sorted(labels.items())] + [f"N={N}"])
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def measure(benchmarks, args, run, baseline, results, regressions, history):
+    #Runs one family at every size, adding its timings to `results` and its regressions to `regressions` as they come
+    for N in args.sizes:
+        for case, labels, seconds in benchmarks(N, args.repeat, args.steps, args.seed):
+            key = case_key(case, labels, N)
+            results[key] = seconds
+            record = {**run, "case": case, **labels, "N": N, "seconds": seconds}
+            line = f"{key:<75} {seconds * 1000:12.3f} ms"
+            if key in baseline:
+                record["baseline"] = baseline[key]
+                ratio = seconds / baseline[key]
+                line += f"  {ratio:6.2f}x baseline"
+                if ratio > 1 + args.threshold and seconds - baseline[key] > args.min_delta:
+                    regressions.append(key)
+                    line += "  REGRESSION"
+            print(line, flush=True)
+            history.write(json.dumps(record) + "\n")
+            history.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the NetworkModel and MoneyModel hot paths.")
+    parser.add_argument("--models", nargs="+", choices=["network", "money"], default=["network"])
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10**2, 10**3, 10**4, 10**5])
+    parser.add_argument("--repeat", type=int, default=3, help="timings per measurement; the fastest is kept")
+    parser.add_argument("--steps", type=int, default=10, help="steps per step/reporter/results_df measurement")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--history", default=os.path.join("benchmarks", "history.jsonl"))
+    parser.add_argument("--baseline", default=os.path.join("benchmarks", "baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true", help="store this run's timings as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="slowdown over the baseline that counts as a regression (0.2 = 20%%)")
+    parser.add_argument("--min-delta", type=float, default=5e-4, help="seconds a measurement must also have slowed by, so timer noise on sub-millisecond cases is not flagged")
+    args = parser.parse_args()
+
+    families = {"network": network_benchmarks, "money": money_benchmarks}
+    mesa_version = None
+    try:
+        import mesa
+        mesa_version = mesa.__version__
+    except ImportError:
+        pass
+    run = {"timestamp": datetime.datetime.now().isoformat(timespec='seconds'), "commit": git_commit(), "python": platform.python_version(),
+           "mesa": mesa_version, "numpy": np.__version__, "machine": platform.machine(), "seed": args.seed}
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = []
+    skipped = {}
+    os.makedirs(os.path.dirname(args.history) or ".", exist_ok=True)
+    with open(args.history, "a") as history:
+        for family in args.models:
+            try:
+                measure(families[family], args, run, baseline, results, regressions, history)
+            except Exception as error:
+                skipped[family] = f"{type(error).__name__}: {error}"
+                print(f"Skipped the rest of the {family} benchmarks: {skipped[family]}", flush=True)
+
+    if args.save_baseline:
+        #Cases that were not measured this time keep their previous baseline
+        saved = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                saved = json.load(f)
+        saved.update(results)
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(saved, f, indent=1, sort_keys=True)
+        print(f"Saved {len(results)} timings as the baseline in {args.baseline}")
+    for family, error in skipped.items():
+        print(f"The {family} benchmarks were skipped ({error})")
+    if regressions:
+        print(f"{len(regressions)} regression(s) over {args.threshold:.0%}:")
+        for key in regressions:
+            print("  " + key)
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()